@@ -6,6 +6,7 @@ from sibtmvar.apis import apifetch as af
 from sibtmvar.apis import apiranklit as arl
 from sibtmvar.apis import apirankvar as arv
 from sibtmvar.apis import apistatus as ast
+from sibtmvar.microservices import cachejanitor as cj
 from sibtmvar.microservices import configuration as conf
 
 app = flask.Flask(__name__)
@@ -18,6 +19,9 @@ conf_mode = "dev2"
 # Load the configuration file
 conf_file = conf.Configuration(conf_mode)
 
+# Clean the cache repository in the background (a single process cleans it at a time)
+cj.startJanitor(conf_file)
+
 #APIs for variomes services
 
 @app.route('/api/isUp', methods=['GET'])
@@ -49,5 +53,11 @@ def getStatus():
     output = ast.getStatus(request, conf_mode=conf_mode)
     return Response(output, content_type="application/json; charset=utf-8")
 
+@app.route('/api/getCacheStatus', methods=['GET'])
+def getCacheStatus():
+    ''' Return the cache counters (hits, misses, evictions) of this process '''
+    output = ast.getCacheStatus(request, conf_mode=conf_mode)
+    return Response(output, content_type="application/json; charset=utf-8")
+
 # Run the API
 app.run(host=conf_file.settings['api']['host'],port=conf_file.settings['api']['port'])
@@ -1,3 +1,5 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from sibtmvar.apis import apiservices as api
 from sibtmvar.microservices import configuration as conf
 from sibtmvar.microservices import documentparser as dp
@@ -71,15 +73,12 @@ def fetchDoc(request, conf_file=None, conf_mode="prod"):
         # Initialize the publication json part
         output['publications'] = []
 
-        # Fetch each document
-        for pub_id in pub_ids.split(";"):
+        # Fetch and process the documents concurrently (results are kept in the order of the identifiers)
+        with ThreadPoolExecutor(max_workers=conf_file.settings['settings_system'].get('fetch_workers', 8)) as executor:
+            documents = list(executor.map(lambda pub_id: fetchDocument(pub_id, collection, hl_entities, conf_file), pub_ids.split(";")))
 
-            # Fetch the document and highlight entities
-            document = dp.DocumentParser(pub_id, collection, conf_file=conf_file)
-            document.setHighlightedEntities(hl_entities)
-            document.fetchMongo()
-            document.processDocument()
-            document.generateJson()
+        # For each document
+        for document in documents:
             doc_json = document.getJson()
 
             # If found, add it to the json
@@ -97,3 +96,15 @@ def fetchDoc(request, conf_file=None, conf_mode="prod"):
 
     # Display the output for the user
     return (api.buildOutput(output, conf_file, errors, api_cache))
+
+def fetchDocument(pub_id, collection, hl_entities, conf_file):
+    ''' Fetch a document, highlight entities and generate its json '''
+
+    # Fetch the document and highlight entities
+    document = dp.DocumentParser(pub_id, collection, conf_file=conf_file)
+    document.setHighlightedEntities(hl_entities)
+    document.fetchMongo()
+    document.processDocument()
+    document.generateJson()
+
+    return document
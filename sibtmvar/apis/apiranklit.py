@@ -33,60 +33,71 @@ def rankLit(request, conf_mode="prod", conf_file=None):
     api_cache = cache.Cache("ranklit", url, "json", conf_file=conf_file)
     if api_cache.isInCache():
 
-        # Reload the cache file
-        output = api_cache.loadFromCache()
+        # Stream the cache file to the user
+        stream = api.streamOutput(api_cache, unique_id)
+        if stream is not None:
+            return stream
 
         # handle errors
         errors += api_cache.errors
 
-    # If not in cache or cache failed
+    # If not in cache or cache failed, compute it (once for identical concurrent queries)
     if output is None:
+        output, errors = api.computeOnce(lambda: processRankLit(request, conf_file, unique_id, list(errors)), conf_file, api_cache)
 
-        # Process all the parameters
-        disease_txt, gen_vars_txt, gender_txt, age_txt = api.processCaseParameters(request)
+        # Stored in cache by the computation
+        api_cache = None
 
-        # Normalize the query
-        query = qu.Query(conf_file)
-        query.setDisease(disease_txt)
-        query.setGenVars(gen_vars_txt)
-        query.setGender(gender_txt)
-        query.setAge(age_txt)
-
-        # Initialize the json output
-        output = {}
+    # Update the unique id (useful when the cache file was generated by another user)
+    if unique_id is not None:
         output['unique_id'] = unique_id
 
-        # Add settings to the output
-        output['settings'] = api.returnSettingsAsJson(conf_file)
+    # Display the output for the user
+    return (api.buildOutput(output, conf_file, errors, api_cache))
 
-        # Add the query to the output
-        output['query'] = query.getInitQuery()
+def processRankLit(request, conf_file, unique_id, errors):
+    ''' Ranks the documents of each collection for the query parameters, returns the output and the errors '''
 
-        # Add the normalized query to the output
-        output['normalized_query'] = query.getNormQuery()
+    # Process all the parameters
+    disease_txt, gen_vars_txt, gender_txt, age_txt = api.processCaseParameters(request)
 
-        # Handle query errors
-        errors += query.errors
+    # Normalize the query
+    query = qu.Query(conf_file)
+    query.setDisease(disease_txt)
+    query.setGenVars(gen_vars_txt)
+    query.setGender(gender_txt)
+    query.setAge(age_txt)
 
-        # Initialize the publication json part
-        output['publications'] = {}
+    # Initialize the json output
+    output = {}
+    output['unique_id'] = unique_id
 
-        # Fetch each document
-        for collection in conf_file.settings['settings_user']['collections']:
-            ranker = rd.RankDoc(query, collection, conf_file=conf_file)
-            ranker.process()
-            output['publications'][collection] = ranker.getJson()
-            errors += ranker.errors
+    # Add settings to the output
+    output['settings'] = api.returnSettingsAsJson(conf_file)
 
-        # Report errors in the json (norm, fetch)
-        output['errors'] = []
-        for error in errors:
-            if error not in output['errors']:
-                output['errors'].append(error)
+    # Add the query to the output
+    output['query'] = query.getInitQuery()
 
-    # Update the unique id (useful when the cache file was generated by another user)
-    if unique_id is not None:
-        output['unique_id'] = unique_id
+    # Add the normalized query to the output
+    output['normalized_query'] = query.getNormQuery()
 
-    # Display the output for the user
-    return (api.buildOutput(output, conf_file, errors, api_cache))
+    # Handle query errors
+    errors += query.errors
+
+    # Initialize the publication json part
+    output['publications'] = {}
+
+    # Fetch each document
+    for collection in conf_file.settings['settings_user']['collections']:
+        ranker = rd.RankDoc(query, collection, conf_file=conf_file)
+        ranker.process()
+        output['publications'][collection] = ranker.getJson()
+        errors += ranker.errors
+
+    # Report errors in the json (norm, fetch)
+    output['errors'] = []
+    for error in errors:
+        if error not in output['errors']:
+            output['errors'].append(error)
+
+    return output, errors
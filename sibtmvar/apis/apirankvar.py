@@ -1,5 +1,3 @@
-import os
-import time
 import copy
 from datetime import datetime
 import json
@@ -10,6 +8,7 @@ from sibtmvar.microservices import configuration as conf
 from sibtmvar.microservices import rankvar as rv
 from sibtmvar.microservices import cache
 from sibtmvar.microservices import query as qu
+from sibtmvar.microservices import singleflight as sf
 
 def rankVar(request, conf_mode="prod", conf_file=None):
     ''' Retrieves a ranked set of documents, highlighted with a set of the query entites'''
@@ -47,163 +46,191 @@ def rankVar(request, conf_mode="prod", conf_file=None):
 
     # Create the cache variables
     api_cache_url = cache.Cache("rankvar", url+genvars_txt, "json", conf_file=conf_file)
-    api_cache_id = cache.Cache("rankvar", unique_id, "json", conf_file=conf_file)
+    api_cache_id = cache.Cache("rankvar_id", unique_id, "json", conf_file=conf_file)
 
-    # If the result is available in cache and the user accepts to use cache (cache by id)
-    if api_cache_id.isInCache(time_limit=False):
-        output = api_cache_id.loadFromCache()
+    # If the result is available in cache and the user accepts to use cache (cache by id, or cache by id written before the rankvar_id service), stream the cache file to the user
+    for api_cache_saved in [api_cache_id, cache.Cache("rankvar", unique_id, "json", conf_file=conf_file)]:
+        if api_cache_saved.isInCache(time_limit=False):
+            stream = api.streamOutput(api_cache_saved, unique_id)
+            if stream is not None:
+                return stream
 
     # If the result is available in cache and the user accepts to use cache (cache by query)
-    elif api_cache_url.isInCache():
+    if api_cache_url.isInCache():
         output = api_cache_url.loadFromCache()
 
-    # If not yet finished processing (reload)
-    elif os.path.isfile(conf_file.settings['repository']['status'] + unique_id + ".txt"):
-
-        # If yes, wait until the cache file is ready (query not yet finished)
-        while not api_cache_id.isInCache(time_limit=False):
-            time.sleep(10)
-
-        # Reload the cache file
-        output = api_cache_id.loadFromCache()
-
     # Store cache errors
     errors += api_cache_url.errors
     errors += api_cache_id.errors
 
-    # If not processed (or if cache failed)
+    # If not processed (or if cache failed), compute it once per unique id: a reload while processing waits for the result, even with another url (e.g. a GET reload of a POST query)
     if output is None:
+        return sf.run(api_cache_id.file_name,
+                      lambda: computeRankVar(request, conf_file, unique_id, genvars_json, errors, api_cache_url, api_cache_id),
+                      lambda: reloadRankVar(api_cache_id),
+                      lease_file=api_cache_id.file_name + ".lease",
+                      lease_timeout=conf_file.settings['cache'].get('lease_timeout', 3600),
+                      poll_interval=conf_file.settings['cache'].get('lease_poll', 2))
 
-        # Create the rankvar object
-        rankvar = rv.RankVar(conf_file=conf_file)
+    # Update the unique id (useful when the cache file was generated by another user)
+    if unique_id is not None:
+        output['unique_id'] = unique_id
 
-        # Process the parameters
-        file_name = api.processFileParameters(request)
+    # Display the output for the user
+    return (api.buildOutput(output, conf_file, errors, api_cache_id, api_cache_url))
 
-        # Process all the parameters
-        disease_txt, gen_vars_txt, gender_txt, age_txt = api.processCaseParameters(request)
+def computeRankVar(request, conf_file, unique_id, genvars_json, errors, api_cache_url, api_cache_id):
+    ''' Computes the output of a query (once for identical concurrent queries), stores it in the cache of its unique id and returns it as a string '''
 
-        # Normalize the query
-        query = qu.Query(conf_file)
-        query.setDisease(disease_txt)
-        query.setGender(gender_txt)
-        query.setAge(age_txt)
+    # Write status (followed by the processing status, unless an identical query is already processing)
+    with open(conf_file.settings['repository']['status'] + unique_id + ".txt", "a") as status_file:
+        status_file.write(datetime.now().strftime("%m/%d/%Y, %H:%M:%S") + "\tWaiting for processing\n")
 
-        topics = []
+    output, errors = api.computeOnce(lambda: processRankVar(request, conf_file, unique_id, genvars_json, list(errors)), conf_file, api_cache_url)
 
-        # If a file is used, then only one case in the parameters (no list of gen-var)
-        if file_name != "":
+    # Update the unique id (useful when the output was computed for another user)
+    output['unique_id'] = unique_id
 
-            # Open the api loaded file
-            file_name = conf_file.settings['repository']['api_files'] + file_name + ".txt"
+    # Store the output in the cache of the unique id (the cache of the query is stored by the computation)
+    return api.buildOutput(output, conf_file, errors, api_cache_id)
 
-            topics = []
+def reloadRankVar(api_cache_id):
+    ''' Reloads the output stored in the cache of a unique id by another process, returns None if not available '''
 
-            try:
-                with open(file_name) as file:
-                    for line in file:
-                        gene, variant = line.strip().split("\t")
-                        topics.append(gene+" ("+variant+")")
+    if api_cache_id.isInCache(time_limit=False):
+        output = api_cache_id.loadFromCache()
+        if output is not None:
+            return json.dumps(output, ensure_ascii=False)
 
-            except:
-                errors.append({"level": "fatal", "service": "vcf", "description": "VCF file not found", "details": file_name})
+    return None
 
-        # If data are posted as json
-        elif (genvars_json is not None):
-            topics = genvars_json['genvars']
+def processRankVar(request, conf_file, unique_id, genvars_json, errors):
+    ''' Ranks the topics (gene and variant pairs) of the query parameters, returns the output and the errors '''
 
+    # Create the rankvar object
+    rankvar = rv.RankVar(conf_file=conf_file)
 
-        # In case of a text, get the list of topics from the case parameters
-        else:
-            for topic in gen_vars_txt.split(";"):
-                topics.append(topic)
+    # Process the parameters
+    file_name = api.processFileParameters(request)
 
-        # Initiate a status file name
-        status_file = open(conf_file.settings['repository']['status'] + unique_id + ".txt", "a+")
+    # Process all the parameters
+    disease_txt, gen_vars_txt, gender_txt, age_txt = api.processCaseParameters(request)
 
-        # Write status
-        now = datetime.now()
-        date_time = now.strftime("%m/%d/%Y, %H:%M:%S")
-        status_file.write(date_time + "\tStart normalizing lines\n")
-        status_file.flush()
+    # Normalize the query
+    query = qu.Query(conf_file)
+    query.setDisease(disease_txt)
+    query.setGender(gender_txt)
+    query.setAge(age_txt)
 
-        # Normalize and store each topic
-        for i, gen_vars_txt in enumerate(topics):
-            this_query = copy.deepcopy(query)
-            this_query.setGenVars(gen_vars_txt)
+    topics = []
 
-            # Write status
-            now = datetime.now()
-            date_time = now.strftime("%m/%d/%Y, %H:%M:%S")
-            status_file.write(date_time + "\tNormalizing variant " + str(i) + "/" + str(len(topics)) + "\n")
-            status_file.flush()
+    # If a file is used, then only one case in the parameters (no list of gen-var)
+    if file_name != "":
 
-            rankvar.addTopic(i, this_query)
+        # Open the api loaded file
+        file_name = conf_file.settings['repository']['api_files'] + file_name + ".txt"
 
-        # Process the topics
-        rankvar.process(unique_id)
-        errors += rankvar.errors
+        topics = []
+
+        try:
+            with open(file_name) as file:
+                for line in file:
+                    gene, variant = line.strip().split("\t")
+                    topics.append(gene+" ("+variant+")")
+
+        except:
+            errors.append({"level": "fatal", "service": "vcf", "description": "VCF file not found", "details": file_name})
+
+    # If data are posted as json
+    elif (genvars_json is not None):
+        topics = genvars_json['genvars']
+
+
+    # In case of a text, get the list of topics from the case parameters
+    else:
+        for topic in gen_vars_txt.split(";"):
+            topics.append(topic)
+
+    # Initiate a status file name
+    status_file = open(conf_file.settings['repository']['status'] + unique_id + ".txt", "a+")
+
+    # Write status
+    now = datetime.now()
+    date_time = now.strftime("%m/%d/%Y, %H:%M:%S")
+    status_file.write(date_time + "\tStart normalizing lines\n")
+    status_file.flush()
+
+    # Normalize and store each topic
+    for i, gen_vars_txt in enumerate(topics):
+        this_query = copy.deepcopy(query)
+        this_query.setGenVars(gen_vars_txt)
 
         # Write status
         now = datetime.now()
         date_time = now.strftime("%m/%d/%Y, %H:%M:%S")
-        status_file.write(date_time + "\tPreparing json ")
+        status_file.write(date_time + "\tNormalizing variant " + str(i) + "/" + str(len(topics)) + "\n")
         status_file.flush()
 
-        # Initialize the json output
-        output = {}
-        output['unique_id'] = unique_id
+        rankvar.addTopic(i, this_query)
 
-        # Add settings to the output
-        output['settings'] = api.returnSettingsAsJson(conf_file)
+    # Process the topics
+    rankvar.process(unique_id, light='light' in request.args)
+    errors += rankvar.errors
 
-        # Add the data part
-        output['data'] = []
+    # Write status
+    now = datetime.now()
+    date_time = now.strftime("%m/%d/%Y, %H:%M:%S")
+    status_file.write(date_time + "\tPreparing json ")
+    status_file.flush()
 
-        # Add the ranked topics
-        for _, row in rankvar.topics_df.iterrows():
+    # Initialize the json output
+    output = {}
+    output['unique_id'] = unique_id
 
-            topic_json = {}
+    # Add settings to the output
+    output['settings'] = api.returnSettingsAsJson(conf_file)
 
-            # Add the query to the output
-            topic_json['query'] = row['topic_query'].getInitQuery()
+    # Add the data part
+    output['data'] = []
 
-            # Add the normalized query to the output
-            topic_json['normalized_query'] = row['topic_query'].getNormQuery()
+    # Add the ranked topics
+    for _, row in rankvar.topics_df.iterrows():
 
-            # Handle query errors
-            errors += query.errors
+        topic_json = {}
 
-            # Add scores
-            for collection in conf_file.settings['settings_user']['collections']:
-                topic_json["score_"+collection] = row[collection+"_sum"]
-                topic_json["count_"+collection] = row[collection+"_nb"]
-            topic_json["total_score"] = row["total_score"]
+        # Add the query to the output
+        topic_json['query'] = row['topic_query'].getInitQuery()
 
-            # Add the publications if not the light mode with just score
-            if not 'light' in request.args:
-                topic_json['publications'] = {}
+        # Add the normalized query to the output
+        topic_json['normalized_query'] = row['topic_query'].getNormQuery()
 
-                for collection in conf_file.settings['settings_user']['collections']:
+        # Handle query errors
+        errors += query.errors
 
-                    # Get the rankdoc
-                    ranker = row[collection+"_ranker"]
-                    topic_json['publications'][collection] = ranker.getJson()
-                    errors += ranker.errors
+        # Add scores
+        for collection in conf_file.settings['settings_user']['collections']:
+            topic_json["score_"+collection] = row[collection+"_sum"]
+            topic_json["count_"+collection] = row[collection+"_nb"]
+        topic_json["total_score"] = row["total_score"]
 
-            # Add the topic to the json
-            output['data'].append(topic_json)
+        # Add the publications if not the light mode with just score
+        if not 'light' in request.args:
+            topic_json['publications'] = {}
 
-        # Report errors in the json (norm, fetch)
-        output['errors'] = []
-        for error in errors:
-            if error not in output['errors']:
-                output['errors'].append(error)
+            for collection in conf_file.settings['settings_user']['collections']:
 
-    # Update the unique id (useful when the cache file was generated by another user)
-    if unique_id is not None:
-        output['unique_id'] = unique_id
+                # Get the rankdoc
+                ranker = row[collection+"_ranker"]
+                topic_json['publications'][collection] = ranker.getJson()
+                errors += ranker.errors
 
-    # Display the output for the user
-    return (api.buildOutput(output, conf_file, errors, api_cache_id, api_cache_url))
+        # Add the topic to the json
+        output['data'].append(topic_json)
+
+    # Report errors in the json (norm, fetch)
+    output['errors'] = []
+    for error in errors:
+        if error not in output['errors']:
+            output['errors'].append(error)
 
+    return output, errors
@@ -1,9 +1,15 @@
 from datetime import datetime
 import json
+import re
 import uuid
 
 import requests
 
+from sibtmvar.microservices import singleflight as sf
+
+# Beginning of the json outputs (the unique id is the first key)
+UNIQUE_ID_PREFIX = re.compile(rb'^\{"unique_id": "(?:[^"\\]|\\.)*"')
+
 def processCaseParameters(request):
     ''' Retrieves parameters specific to a set of topics '''
 
@@ -131,6 +137,9 @@ def processSettingsParameters(conf_file, request):
     if 'nb' in request.args and request.args['nb'] != "":
         conf_file.settings['settings_user']['es_results_nb'] = int(request.args['nb'])
 
+    if 'details' in request.args and request.args['details'] in ("none", "facets", "full"):
+        conf_file.settings['settings_user']['details'] = request.args['details']
+
     return conf_file
 
 def returnSettingsAsJson(conf_file):
@@ -150,6 +159,7 @@ def returnSettingsAsJson(conf_file):
     settings_json['synonym_disease'] = conf_file.settings['settings_user']['synonym_disease']
     settings_json['synonym_gene'] = conf_file.settings['settings_user']['synonym_gene']
     settings_json['synonym_variant'] = conf_file.settings['settings_user']['synonym_variant']
+    settings_json['details'] = conf_file.settings['settings_user'].get('details', 'full')
 
     return settings_json
 
@@ -157,8 +167,8 @@ def str2bool(v):
     # Convert a string to a boolean
     return str(v).lower() in ("yes", "true", "t", "1")
 
-def buildOutput(output_json, conf_file, errors, cache, secondary_cache=None):
-    ''' Returns a json as a string, using UTF-8 encoding '''
+def buildOutput(output_json, conf_file, errors, cache=None, secondary_cache=None):
+    ''' Returns a json as a string, using UTF-8 encoding (the output is stored in the caches received as parameters) '''
 
     # Check if fatal errors occurred
     for error in errors:
@@ -179,11 +189,12 @@ def buildOutput(output_json, conf_file, errors, cache, secondary_cache=None):
 
 
     # Print it in the cache file
-    cache.storeToCache(json.dumps(output_json, ensure_ascii=False))
+    if cache is not None:
+        cache.storeToCache(json.dumps(output_json, ensure_ascii=False))
 
-    # Add eventual errors on cache
-    for error in cache.errors:
-        output_json['errors'].append(error)
+        # Add eventual errors on cache
+        for error in cache.errors:
+            output_json['errors'].append(error)
 
     # If secondary cache
     if secondary_cache is not None:
@@ -205,6 +216,70 @@ def buildOutput(output_json, conf_file, errors, cache, secondary_cache=None):
     # Return the string
     return json_string
 
+def computeOnce(compute, conf_file, cache):
+    ''' Computes an output once for identical concurrent queries (same cache file): the first query computes the output and stores it in cache, the other ones (in this process or in another one) wait and share it. Returns the output and the errors '''
+
+    def computeAndStore():
+
+        # Compute the output
+        output_json, errors = compute()
+        json_string = json.dumps(output_json, ensure_ascii=False)
+
+        # Store it for the followers of other processes (unless a fatal error occurred)
+        if all(error['level'] != "fatal" for error in errors):
+            cache.storeToCache(json_string)
+
+        return json_string, tuple(errors + cache.errors)
+
+    def reload():
+
+        # Reload the output stored by the leader of another process
+        if cache.isInCache():
+            output_json = cache.loadFromCache()
+            if output_json is not None:
+                return json.dumps(output_json, ensure_ascii=False), ()
+
+        return None
+
+    # Run the computation, the output is shared as a string (each query gets its own copy)
+    json_string, errors = sf.run(cache.file_name, computeAndStore, reload, lease_file=cache.file_name + ".lease",
+                                 lease_timeout=conf_file.settings['cache'].get('lease_timeout', 3600),
+                                 poll_interval=conf_file.settings['cache'].get('lease_poll', 2))
+
+    return json.loads(json_string), list(errors)
+
+def streamOutput(cache, unique_id):
+    ''' Returns a cached output as a generator of UTF-8 chunks (e.g. for a streamed HTTP response, the output is not decoded), with the unique id of the query, or None if the cache file cannot be loaded '''
+
+    chunks = cache.streamFromCache()
+    if chunks is None:
+        return None
+
+    return replaceUniqueId(chunks, unique_id)
+
+def replaceUniqueId(chunks, unique_id):
+    ''' Yields the chunks of a json output, with the unique id replaced (useful when the cache file was generated by another user) '''
+
+    # Get the beginning of the output, until the unique id is found
+    head = b""
+    for chunk in chunks:
+        if head is None:
+            yield chunk
+            continue
+
+        head += chunk
+        match = UNIQUE_ID_PREFIX.match(head)
+        if match is not None and unique_id is not None:
+            yield ('{"unique_id": ' + json.dumps(unique_id, ensure_ascii=False)).encode("utf-8") + head[match.end():]
+            head = None
+        elif match is not None or len(head) > 4096:
+            yield head
+            head = None
+
+    # Output shorter than the unique id
+    if head:
+        yield head
+
 def logQuery(user_query, service, conf_file, ip_address=None):
     ''' Stores a query in the log files '''
 
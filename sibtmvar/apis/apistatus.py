@@ -26,10 +26,10 @@ def getStatus(request, conf_mode="prod", conf_file=None):
 
 
     # Create the cache variables
-    api_cache_id = cache.Cache("rankvar", unique_id, "json", conf_file=conf_file)
+    api_cache_id = cache.Cache("rankvar_id", unique_id, "json", conf_file=conf_file)
 
-    # If the result is available in cache and the user accepts to use cache (cache by id)
-    if api_cache_id.isInCache(time_limit=False):
+    # If the result is available in cache and the user accepts to use cache (cache by id, or cache by id written before the rankvar_id service)
+    if api_cache_id.isInCache(time_limit=False) or cache.Cache("rankvar", unique_id, "json", conf_file=conf_file).isInCache(time_limit=False):
         output = "Processing is finished, results will be displayed in a few seconds."
 
     # If not yet finished processing (get the last line)
@@ -46,3 +46,9 @@ def getStatus(request, conf_mode="prod", conf_file=None):
 
     # Display the output for the user
     return (json.dumps(output_json, ensure_ascii=False))
+
+def getCacheStatus(request, conf_mode="prod", conf_file=None):
+    ''' Retrieves the counters of the cache (lookups, in-memory tier and cache files) of this process '''
+
+    # Display the output for the user
+    return (json.dumps(cache.getStatistics(), ensure_ascii=False))
@@ -1,10 +1,179 @@
+import gzip
 import hashlib
+import io
 import os.path
 from pathlib import Path
+import threading
 import time
 import json
+import zlib
 
+from sibtmvar.microservices import cachejanitor as cj
 from sibtmvar.microservices import configuration as conf
+from sibtmvar.microservices import lru
+
+# Zstandard compression is optional
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Header of cache files: magic, creation time, crc32 checksum and length of the stored content, compression
+CACHE_HEADER = b"SIBTMCACHE1"
+
+# Number of days a cache file is used, for services missing in older config files
+DEFAULT_SAVED_DAYS = 1
+
+# Size of the chunks of streamed cache files
+STREAM_CHUNK_SIZE = 65536
+
+# Number of directory levels of the sharded layout, and number of characters of the key per level
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+# Process-wide in-memory tier of the cache (file name -> (creation time, compression, stored content)), created on first use
+_memory_tier = None
+_memory_tier_lock = threading.Lock()
+
+# Lookup counters of each service (memory hits, disk hits, misses)
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def hashKey(query):
+    ''' Return the hashed key of a query '''
+    return hashlib.sha224(query.encode(encoding='UTF-8', errors='strict')).hexdigest()
+
+
+def shardFileName(repository, key, file_type):
+    ''' Return the file name of a key in the sharded layout of a service repository (e.g. repository/ab/cd/abcd...json) '''
+
+    shards = [key[i*SHARD_WIDTH:(i+1)*SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+
+    return repository + "/".join(shards) + "/" + key + "." + file_type
+
+
+def getMemoryTier(conf_file):
+    ''' Return the in-memory tier shared by the whole process (created on first use), bounded by a number of entries and a total size '''
+
+    global _memory_tier
+
+    with _memory_tier_lock:
+        if _memory_tier is None:
+            max_entries = conf_file.settings['cache'].get('memory_cache_entries', 100000)
+            max_bytes = conf_file.settings['cache'].get('memory_cache_mb', 256) * 1024 * 1024
+            _memory_tier = lru.LRUCache(max_entries, max_bytes=max_bytes, sizeof=lambda entry: len(entry[2]))
+
+    return _memory_tier
+
+
+def countLookup(service_type, result):
+    ''' Increment a lookup counter of a service '''
+
+    with _counters_lock:
+        counters = _counters.setdefault(service_type, {"memory_hits": 0, "disk_hits": 0, "misses": 0})
+        counters[result] += 1
+
+
+def getStatistics():
+    ''' Return the counters of the cache: lookups of each service, memory tier and janitor (files, expired and evicted files of each service) '''
+
+    with _counters_lock:
+        lookups = {service_type: dict(counters) for service_type, counters in _counters.items()}
+
+    memory = _memory_tier.getStatistics() if _memory_tier is not None else {}
+
+    return {"lookups": lookups, "memory": memory, "disk": cj.getJanitorStatistics()}
+
+
+def buildHeader(content, compression="none"):
+    ''' Return the header line of a cache file content (bytes, as stored) '''
+    return CACHE_HEADER + (" %.3f %08x %d %s\n" % (time.time(), zlib.crc32(content), len(content), compression)).encode("ascii")
+
+
+def parseEntry(data):
+    ''' Return the creation time, the compression and the stored content of a cache file, the creation time is None for files written before headers existed, raise ValueError if the file is corrupted '''
+
+    # Files without header
+    if not data.startswith(CACHE_HEADER + b" "):
+        return None, "none", data
+
+    # Check the header (files written before compression existed are not compressed)
+    header, _, content = data.partition(b"\n")
+    fields = header.decode("ascii").split(" ")
+    _, created, checksum, length = fields[:4]
+    compression = fields[4] if len(fields) > 4 else "none"
+    if len(content) != int(length) or zlib.crc32(content) != int(checksum, 16):
+        raise ValueError("Corrupted cache file")
+
+    return float(created), compression, content
+
+
+def getCompression(compression):
+    ''' Return the compression to use, zstd is replaced by gzip if the zstandard module is not available '''
+
+    if compression == "zstd" and zstandard is None:
+        return "gzip"
+    if compression not in ("gzip", "zstd"):
+        return "none"
+
+    return compression
+
+
+def compress(content, compression):
+    ''' Compress a content (bytes) '''
+
+    if compression == "gzip":
+        return gzip.compress(content, compresslevel=6)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().compress(content)
+
+    return content
+
+
+def decompress(content, compression):
+    ''' Decompress a stored content (bytes), raise ValueError if it cannot be decompressed '''
+
+    try:
+        if compression == "gzip":
+            return gzip.decompress(content)
+        if compression == "zstd":
+            return zstandard.ZstdDecompressor().decompress(content)
+    except Exception as error:
+        raise ValueError("Invalid compressed cache file: " + str(error))
+
+    if compression != "none":
+        raise ValueError("Unknown cache compression: " + compression)
+
+    return content
+
+
+def decompressChunks(content, compression, chunk_size=STREAM_CHUNK_SIZE):
+    ''' Yield the decompressed content of a stored content (bytes), chunk by chunk '''
+
+    # Gzip: bound the size of each decompressed chunk
+    if compression == "gzip":
+        decompressor = zlib.decompressobj(wbits=31)
+        for i in range(0, len(content), chunk_size):
+            data = content[i:i+chunk_size]
+            while len(data) > 0:
+                chunk = decompressor.decompress(data, chunk_size)
+                if len(chunk) > 0:
+                    yield chunk
+                data = decompressor.unconsumed_tail
+        chunk = decompressor.flush()
+        if len(chunk) > 0:
+            yield chunk
+
+    # Zstandard
+    elif compression == "zstd":
+        yield from zstandard.ZstdDecompressor().read_to_iter(io.BytesIO(content), read_size=chunk_size, write_size=chunk_size)
+
+    # Not compressed
+    else:
+        for i in range(0, len(content), chunk_size):
+            yield content[i:i+chunk_size]
+
 
 class Cache:
     '''
@@ -33,6 +202,10 @@ class Cache:
         service_type describe a service that can be cached (e.g. synvar)
     file_name: str
         an absolute file name for the cache file
+    compression: str
+        the compression of the stored content (none, gzip or zstd), defined per service in the config file
+    memory_tier: LRUCache
+        the in-memory tier shared by the whole process, in front of the cache files
     '''
 
     def __init__(self, service_type, query, file_type="txt", conf_file=None, conf_name="prod"):
@@ -54,106 +227,168 @@ class Cache:
         # Generate the file name for the cache file
         self.file_name = self.generateFileName(file_type, query)
 
+        # Define the compression of the service
+        self.compression = getCompression(self.conf_file.settings['cache'].get('compression_' + service_type, "none"))
 
-    def generateFileName(self, file_type, query):
-        ''' Define the file name for the cache file, create the repository to store the file and return the absolute file name '''
+        # Use the in-memory tier
+        self.memory_tier = getMemoryTier(self.conf_file)
 
-        # Transform the query in a unique hashed key
-        if len(query) > 20:
-            query = hashlib.sha224(query.encode(encoding='UTF-8', errors='strict')).hexdigest()
 
-        # If special characters, remove
-        invalid = '<>:"/\|?* '
-        for char in invalid:
-            query = query.replace(char, '')
+    def generateFileName(self, file_type, query):
+        ''' Define the file name for the cache file and return the absolute file name (its directory is created when the file is stored) '''
 
-        # Create the directory for the service if it does not exist
-        repository = self.conf_file.settings['repository']['cache'] + self.service_type + "/"
-        Path(repository).mkdir(parents=True, exist_ok=True)
+        # Transform the query in a unique hashed key (uniform and safe file names)
+        key = hashKey(query)
 
-        # Define a file name for the cache file: cache_repository/service_type/key_name.file_type
-        return repository + query + "." + file_type
+        # Define a file name for the cache file: cache_repository/service_type/ab/cd/key_name.file_type
+        file_name = shardFileName(self.conf_file.settings['repository']['cache'] + self.service_type + "/", key, file_type)
+
+        return file_name
 
     def isInCache(self, time_limit=True):
         ''' Return true if the service should use the cache system and a recent cache file exist for this query, return false otherwise. '''
 
         # Check if the cache system is activated for the requested service (according to the activation status defined in the config file)
-        if self.conf_file.settings['cache']['is_activated_'+self.service_type]:
+        if self.isActivated():
 
             # Check if the user agrees to use cache (or for synvar, use it anyway)
             if self.conf_file.settings['settings_user']['cache'] or self.service_type == "synvar":
 
+                # Check the in-memory tier first (no file system access)
+                entry = self.memory_tier.get(self.file_name)
+                if entry is not None and (not time_limit or self.isRecent(entry[0])):
+                    countLookup(self.service_type, "memory_hits")
+                    return True
+
                 # Check if the file exist
                 if os.path.exists(self.file_name):
 
-                    # If a time limit has been defined
-                    if time_limit:
-
-                        # Get time of last modification
-                        last_modified = os.path.getmtime(self.file_name)
-
-                        # Check if last modification is recent (according to the number of days defined in the config file)
-                        if time.time() - last_modified < self.conf_file.settings['cache']['saved_days_' + self.service_type] * 86400:
-                            return True
-
-                    else:
+                    # If a time limit has been defined, check the time of last modification
+                    if not time_limit or self.isRecent(os.path.getmtime(self.file_name)):
+                        countLookup(self.service_type, "disk_hits")
                         return True
 
+                countLookup(self.service_type, "misses")
+
         # If the service is not activated, the file does not exist or the file is too old
         return False
 
+    def isActivated(self):
+        ''' Return true if the cache system is activated for the service (activated by default for services missing in older config files) '''
+        return self.conf_file.settings['cache'].get('is_activated_' + self.service_type, True)
+
+    def isRecent(self, created):
+        ''' Return true if a cache entry is recent (according to the number of days defined in the config file) '''
+        return time.time() - created < self.conf_file.settings['cache'].get('saved_days_' + self.service_type, DEFAULT_SAVED_DAYS) * 86400
+
+    def keepInMemory(self, created, compression, content):
+        ''' Store the stored content of a cache file in the in-memory tier, unless it is too large '''
+
+        max_bytes = min(self.conf_file.settings['cache'].get('memory_entry_max_mb', 16), self.conf_file.settings['cache'].get('memory_cache_mb', 256)) * 1024 * 1024
+        if len(content) <= max_bytes:
+            self.memory_tier.put(self.file_name, (created, compression, content))
+
+    def loadStoredContent(self):
+        ''' Return the compression and the stored content of a cache file, from the in-memory tier if available (files are written atomically, a single read is enough), raise IOError or ValueError if it cannot be loaded '''
+
+        # Get the content from the in-memory tier
+        entry = self.memory_tier.get(self.file_name)
+        if entry is not None:
+            return entry[1], entry[2]
+
+        # Reload the cache file and keep it in memory (files without header are dated by their last modification)
+        with open(self.file_name, "rb") as file:
+            created, compression, content = parseEntry(file.read())
+        if created is None:
+            created = os.path.getmtime(self.file_name)
+        self.keepInMemory(created, compression, content)
+
+        return compression, content
+
     def loadFromCache(self):
         ''' Read a file from cache '''
 
         file_content = None
 
-        # Up to 5 attemps to load the file in case it is not yet ready
-        for i in range(5):
+        try:
 
-            # Reload the cache file
-            try:
-                with open(self.file_name, encoding="utf-8") as file:
+            # Get the content, decompressed
+            compression, content = self.loadStoredContent()
+            content = decompress(content, compression)
 
-                    # Json files
-                    if ".json" in self.file_name:
-                        file_content = json.load(file)
+            # Binary files
+            if self.file_name.endswith(".bin"):
+                file_content = content
 
-                    # Other files
-                    else:
-                        file_content = file.read()
+            # Json files
+            elif ".json" in self.file_name:
+                file_content = json.loads(content.decode("utf-8"))
 
-                    return file_content
+            # Other files
+            else:
+                file_content = content.decode("utf-8")
 
+        # Store errors if failed to load (missing, corrupted or invalid file)
+        except (IOError, ValueError):
+            self.errors.append({"level": "warning", "service":"cache", "description": "Cache file loading failed", "details":self.file_name})
 
-            # Store errors if failed to load
-            except IOError:
-                time.sleep(3)
+        return file_content
 
-        self.errors.append({"level": "warning", "service":"cache", "description": "Cache file loading failed", "details":self.file_name})
+    def streamFromCache(self, chunk_size=STREAM_CHUNK_SIZE):
+        ''' Return a generator of the content of a cache file as chunks of bytes (decompressed on the fly, without decoding the content as a whole, e.g. for an HTTP response), or None if the file cannot be loaded '''
 
-        return file_content
+        # Load and check the stored content before streaming
+        try:
+            compression, content = self.loadStoredContent()
+            if compression not in ("none", "gzip") and not (compression == "zstd" and zstandard is not None):
+                raise ValueError("Unknown cache compression: " + compression)
+
+        # Store errors if failed to load (missing, corrupted or invalid file)
+        except (IOError, ValueError):
+            self.errors.append({"level": "warning", "service":"cache", "description": "Cache file loading failed", "details":self.file_name})
+            return None
+
+        return decompressChunks(content, compression, chunk_size)
 
     def storeToCache(self, file_content):
         ''' Print the file content in the cache file '''
 
         # Check if the cache system is activated for the requested service (according to the activation status defined in the config file)
-        if self.conf_file.settings['cache']['is_activated_' + self.service_type]:
+        if self.isActivated():
 
             # Check if the user agrees to use cache (or for synvar, use it anyway)
             if self.conf_file.settings['settings_user']['cache'] or self.service_type == "synvar":
 
+                # Encode the content with UTF-8 encoding (binary content is written as is)
+                if not isinstance(file_content, bytes):
+                    file_content = file_content.encode("utf-8")
+
+                # Compress the content (according to the compression of the service)
+                file_content = compress(file_content, self.compression)
+
+                # Write in a temporary file, unique per process and thread
+                temp_file_name = self.file_name + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+
                 try:
 
-                    # Create file, with UTF-8 encoding
-                    f_out = open(self.file_name, 'w', encoding="utf-8")
+                    # Create the directory for the shard if it does not exist
+                    Path(os.path.dirname(self.file_name)).mkdir(parents=True, exist_ok=True)
 
-                    # Print in the file
-                    f_out.write(file_content)
+                    # Print the header and the content in the temporary file
+                    with open(temp_file_name, 'wb') as f_out:
+                        f_out.write(buildHeader(file_content, self.compression))
+                        f_out.write(file_content)
 
-                    # Close the file
-                    f_out.flush()
-                    f_out.close()
+                    # Replace the cache file at once (readers see the old or the new file, never a partial one)
+                    os.replace(temp_file_name, self.file_name)
+
+                    # Keep the content in memory
+                    self.keepInMemory(time.time(), self.compression, file_content)
 
                 # Store errors if failed to write
                 except:
                     self.errors.append({"level": "warning", "service":"cache", "description": "Cache file writing failed", "details":self.file_name})
+
+                    # Remove the temporary file
+                    if os.path.exists(temp_file_name):
+                        os.remove(temp_file_name)
@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+from sibtmvar.microservices import configuration as conf
+from sibtmvar.microservices import singleflight as sf
+
+# Process-wide janitor, started by the API (or run as a separate job with this module)
+_janitor = None
+_janitor_lock = threading.Lock()
+
+# Age (in seconds) after which temporary and lease files are considered as abandoned
+ABANDONED_AGE = 86400
+
+
+def startJanitor(conf_file):
+    ''' Start the janitor of the cache repository in a background thread, once per process (unless disabled in the configuration) '''
+
+    global _janitor
+
+    # Check if the janitor is activated
+    if conf_file.settings['cache'].get('janitor_interval', 3600) <= 0:
+        return None
+
+    with _janitor_lock:
+        if _janitor is None:
+            _janitor = CacheJanitor(conf_file)
+            _janitor.start()
+
+    return _janitor
+
+
+def getJanitorStatistics():
+    ''' Return the counters of the janitor (empty if not started) '''
+
+    if _janitor is None:
+        return {}
+
+    return _janitor.getStatistics()
+
+
+class CacheJanitor(threading.Thread):
+    '''
+    The CacheJanitor object periodically removes expired cache files (saved_days) and the least recently written ones of each service exceeding its disk budget (services without budget, e.g. the rankvar results saved by unique id, are only expired).
+    A lease file in the cache repository ensures that a single process (API worker or separate job) cleans the repository at a time
+
+    Parameters
+    ----------
+    conf_file: Configuration
+        indicate a Configuration object to use (only the cache settings are used)
+
+    Attributes
+    ----------
+    conf_file: Configuration
+        indicate a Configuration object to use
+    interval: int
+        the number of seconds between two cleanings
+    lease_timeout: int
+        the number of seconds after which the lease of a crashed janitor is taken over
+    statistics: dict
+        the counters of each service (files, bytes, expired, evicted)
+    errors: list
+        stores a list of errors with a json format
+
+    '''
+
+    def __init__(self, conf_file):
+        ''' The constructor loads the janitor settings '''
+
+        super().__init__(name="cache-janitor", daemon=True)
+
+        self.errors = []
+        self.conf_file = conf_file
+        self.interval = self.conf_file.settings['cache'].get('janitor_interval', 3600)
+        self.lease_timeout = self.conf_file.settings['cache'].get('lease_timeout', 3600)
+        self.statistics = {}
+        self.lock = threading.Lock()
+
+    def run(self):
+        ''' Clean the cache repository forever '''
+
+        while True:
+            self.clean()
+            time.sleep(self.interval)
+
+    def clean(self):
+        ''' Clean the directory of each service of the cache repository, return false if another process is already cleaning it '''
+
+        repository = self.conf_file.settings['repository']['cache']
+
+        # Skip the pass if another process holds the lease of the repository
+        lease_file = os.path.join(repository, ".janitor.lease")
+        if not sf.acquireLease(lease_file, self.lease_timeout):
+            return False
+
+        # Keep the lease alive while cleaning (long passes are not taken over)
+        heartbeat = threading.Event()
+        threading.Thread(target=sf.keepLease, args=(lease_file, self.lease_timeout, heartbeat), daemon=True).start()
+
+        try:
+            try:
+                services = [entry.name for entry in os.scandir(repository) if entry.is_dir()]
+            except OSError:
+                self.errors.append({"level": "warning", "service": "cache", "description": "Cache repository not readable", "details": repository})
+                return True
+
+            for service in services:
+                self.cleanService(service, os.path.join(repository, service))
+
+            return True
+
+        finally:
+            heartbeat.set()
+            sf.releaseLease(lease_file)
+
+    def cleanService(self, service, repository):
+        ''' Remove the expired files of a service, then the oldest ones until the service fits in its disk budget '''
+
+        now = time.time()
+        cache_settings = self.conf_file.settings['cache']
+
+        # Files older than the expiry are removed (default: saved days of the service, no expiry if not defined)
+        days = cache_settings.get('expire_days_' + service, cache_settings.get('saved_days_' + service))
+        max_age = days * 86400 if days is not None else None
+
+        # Disk budget of the service in MB (no budget if not defined)
+        budget = cache_settings.get('disk_budget_mb_' + service)
+        max_bytes = budget * 1024 * 1024 if budget is not None and budget > 0 else None
+
+        files = []
+        expired = 0
+        for directory, _, file_names in os.walk(repository):
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                age = now - stat.st_mtime
+
+                # Temporary and lease files are written by running requests, remove only abandoned ones
+                if file_name.endswith(".tmp") or file_name.endswith(".lease"):
+                    if age > ABANDONED_AGE:
+                        self.removeFile(path)
+                    continue
+
+                # Remove expired files
+                if max_age is not None and age > max_age:
+                    if self.removeFile(path):
+                        expired += 1
+                    continue
+
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        # Remove the oldest files until the service fits in its budget
+        evicted = 0
+        total_bytes = sum(size for _, size, _ in files)
+        if max_bytes is not None and total_bytes > max_bytes:
+            files.sort()
+            for _, size, path in files:
+                if total_bytes <= max_bytes:
+                    break
+                if self.removeFile(path):
+                    total_bytes -= size
+                    evicted += 1
+
+        # Update the counters
+        with self.lock:
+            statistics = self.statistics.setdefault(service, {"files": 0, "bytes": 0, "expired": 0, "evicted": 0})
+            statistics['files'] = len(files) - evicted
+            statistics['bytes'] = total_bytes
+            statistics['expired'] += expired
+            statistics['evicted'] += evicted
+
+    def removeFile(self, path):
+        ''' Remove a cache file, return true if removed '''
+
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def getStatistics(self):
+        ''' Return a copy of the counters of each service '''
+
+        with self.lock:
+            return {service: dict(statistics) for service, statistics in self.statistics.items()}
+
+
+if __name__ == "__main__":
+
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description="Clean the cache repository of sibtm-variomes (e.g. from a cron job, instead of the janitor of the API)")
+    parser.add_argument("--conf", default="prod", help="the configuration to use (default: prod)")
+    parser.add_argument("--once", action="store_true", help="clean the repository once and exit (default: clean it every janitor_interval seconds, once if disabled)")
+    args = parser.parse_args()
+
+    # Clean the cache repository
+    conf_file = conf.Configuration(args.conf)
+    for error in conf_file.errors:
+        print(error)
+    janitor = CacheJanitor(conf_file)
+    if not args.once and janitor.interval > 0:
+        janitor.run()
+    if not janitor.clean():
+        print("Cache repository already cleaned by another process")
+    for error in janitor.errors:
+        print(error)
+    for service, statistics in janitor.getStatistics().items():
+        print(service + ": " + json.dumps(statistics))
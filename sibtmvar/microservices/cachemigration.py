@@ -0,0 +1,74 @@
+import argparse
+import os
+import re
+
+from sibtmvar.microservices import cache
+from sibtmvar.microservices import configuration as conf
+
+# Name of the hashed keys of the previous flat layout
+HASHED_KEY = re.compile(r"^[0-9a-f]{56}$")
+
+
+def migrate(conf_file, services=None, dry_run=False):
+    ''' Move the cache files of the flat layout (cache_repository/service_type/key.file_type) to the sharded layout, return the number of moved files of each service '''
+
+    repository = conf_file.settings['repository']['cache']
+    moved = {}
+
+    # For each service (all services by default)
+    if services is None:
+        services = [entry.name for entry in os.scandir(repository) if entry.is_dir()]
+
+    for service_type in services:
+        service_repository = repository + service_type + "/"
+        moved[service_type] = 0
+
+        if not os.path.isdir(service_repository):
+            continue
+
+        # Only the files of the service directory belong to the flat layout (shards are directories)
+        for entry in os.scandir(service_repository):
+            if not entry.is_file():
+                continue
+
+            # Skip temporary and lease files of running requests
+            if entry.name.endswith(".tmp") or entry.name.endswith(".lease"):
+                continue
+
+            key, _, file_type = entry.name.rpartition(".")
+            if key == "":
+                continue
+
+            # Short keys were not hashed (keys with removed special characters cannot be found anymore, the janitor expires them)
+            if HASHED_KEY.match(key) is None:
+                key = cache.hashKey(key)
+
+            # Move the file to its shard, unless a newer version already exists
+            file_name = cache.shardFileName(service_repository, key, file_type)
+            if not dry_run:
+                os.makedirs(os.path.dirname(file_name), exist_ok=True)
+                if os.path.exists(file_name):
+                    os.remove(entry.path)
+                    continue
+                os.replace(entry.path, file_name)
+            moved[service_type] += 1
+
+    return moved
+
+
+if __name__ == "__main__":
+
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description="Move the cache files of sibtm-variomes to the sharded layout")
+    parser.add_argument("--conf", default="prod", help="the configuration to use (default: prod)")
+    parser.add_argument("--services", default=None, help="the services to migrate, e.g. es,synvar (default: all)")
+    parser.add_argument("--dry-run", action="store_true", help="count the files to move without moving them")
+    args = parser.parse_args()
+
+    # Migrate the cache files
+    conf_file = conf.Configuration(args.conf)
+    for error in conf_file.errors:
+        print(error)
+    services = args.services.split(",") if args.services is not None else None
+    for service_type, nb_files in migrate(conf_file, services, args.dry_run).items():
+        print(service_type + ": " + str(nb_files) + " files")
@@ -8,7 +8,7 @@ SVIP Project
 # !/usr/local/bin/python3.8
 import re
 import json
-from elasticsearch import Elasticsearch  # Import Elasticsearch package
+from sibtmvar.microservices import esclient as esc  # Pooled Elasticsearch clients
 
 #To split paragraph in sentence
 def splitParagraphIntoSentences2(paragraph):
@@ -36,7 +36,7 @@ def splitParagraphIntoSentences2(paragraph):
     return sentenceList
 
 def rankCT(genvar, disease, gender, age, variant_must, elasticsearch_host="localhost", elasticsearch_port=9201,
-               elasticsearch_index="ct_annot_data2019_nov"):
+               elasticsearch_index="ct_annot_data2019_nov", request_timeout=60):
     print(genvar)
     print(disease)
     print(gender)
@@ -130,7 +130,7 @@ def rankCT(genvar, disease, gender, age, variant_must, elasticsearch_host="local
 
     # >>> CONNEXION A ELASTICSEARCH
     #es = Elasticsearch([{'host': 'localhost', 'port': 9201}])
-    es = Elasticsearch([{'host': elasticsearch_host, 'port': elasticsearch_port}])
+    es = esc.getClient(elasticsearch_host, elasticsearch_port)
 
     # Parameters
     boost_variant_query = 100
@@ -379,7 +379,7 @@ def rankCT(genvar, disease, gender, age, variant_must, elasticsearch_host="local
         variant = decoupe[1]
         query = (buildQuery(gene_norm, id_disease, variant, age_years, age_months, age_days, gender_norm, variant_must))
 
-        query_exec = es.search(index=elasticsearch_index, body=query, size=1000)
+        query_exec = es.search(index=elasticsearch_index, body=query, size=1000, request_timeout=request_timeout)
 
         # JSON structures construction #
         mylistct["score"] = ('test')
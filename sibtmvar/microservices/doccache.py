@@ -0,0 +1,126 @@
+import copy
+import json
+import threading
+import time
+
+from sibtmvar.microservices import cache
+from sibtmvar.microservices import lru
+
+# Process-wide document cache, created on first use
+_document_cache = None
+_document_cache_lock = threading.Lock()
+
+
+def getDocumentCache(conf_file):
+    ''' Return the document cache shared by the whole process (created on first use), or None if the user does not agree to use cache '''
+
+    global _document_cache
+
+    # Check if the user agrees to use cache
+    if not conf_file.settings['settings_user']['cache']:
+        return None
+
+    with _document_cache_lock:
+        if _document_cache is None:
+            _document_cache = DocumentCache(conf_file)
+
+    return _document_cache
+
+
+class DocumentCache:
+    '''
+    The DocumentCache object keeps documents information (mongodb fields, statistics) in memory, indexed by collection and document identifier
+
+    Parameters
+    ----------
+    conf_file: Configuration
+        indicate a Configuration object to use (only system settings are used, the cache is shared by all requests)
+
+    Attributes
+    ----------
+    conf_file: Configuration
+        indicate a Configuration object to use
+    entries: LRUCache
+        the cached documents, each one is a dictionary of parts (fields, information_extraction, facet_details)
+    ttl: int
+        the number of seconds a document stays valid (in memory and on the disk)
+    spill: bool
+        true if the entries evicted from memory are stored in the disk cache
+
+    '''
+
+    def __init__(self, conf_file):
+        ''' The constructor creates the in-memory cache according to the configuration '''
+
+        self.conf_file = conf_file
+
+        # Load settings
+        max_size = self.conf_file.settings['cache'].get('doc_cache_size', 10000)
+        self.ttl = self.conf_file.settings['cache'].get('doc_cache_ttl', 86400)
+        self.spill = self.conf_file.settings['cache'].get('doc_cache_spill', False)
+
+        # Create the in-memory cache
+        self.entries = lru.LRUCache(max_size, ttl=self.ttl, on_evict=self.spillEntry if self.spill else None)
+
+    def getEntry(self, collection, doc_id):
+        ''' Return all cached parts of a document, or None if not available '''
+
+        # Get the document from memory, or from the disk if evicted
+        key = (collection, doc_id)
+        entry = self.entries.get(key)
+        if entry is None and self.spill:
+            entry = self.loadEntry(key)
+
+        return entry
+
+    def get(self, collection, doc_id, part):
+        ''' Return a part of a cached document, or None if not available '''
+
+        # If the part is not available
+        entry = self.getEntry(collection, doc_id)
+        if entry is None or part not in entry:
+            return None
+
+        # Return a copy (documents are modified while processed)
+        return copy.deepcopy(entry[part])
+
+    def has(self, collection, doc_id, parts):
+        ''' Return true if all parts of a document are cached '''
+
+        entry = self.getEntry(collection, doc_id)
+        return entry is not None and all(part in entry for part in parts)
+
+    def update(self, collection, doc_id, part, value):
+        ''' Store a part of a document '''
+
+        # Add the part to the parts already cached (in memory or spilled on the disk)
+        key = (collection, doc_id)
+        entry = dict(self.getEntry(collection, doc_id) or {})
+        entry[part] = copy.deepcopy(value)
+
+        # Keep the creation time of the entry (adding a part does not extend the life of the other ones)
+        self.entries.put(key, entry, keep_created=True)
+
+    def spillEntry(self, key, entry, created):
+        ''' Store an entry evicted from memory in the disk cache, with its creation time (expired entries are not evicted to the disk) '''
+
+        collection, doc_id = key
+        doc_cache = cache.Cache("documents", collection + "_" + str(doc_id), "json", conf_file=self.conf_file)
+        doc_cache.storeToCache(json.dumps({"created": created, "entry": entry}, default=str))
+
+    def loadEntry(self, key):
+        ''' Reload an entry from the disk cache and store it back in memory with its creation time, unless it expired (doc_cache_ttl) '''
+
+        entry = None
+
+        collection, doc_id = key
+        doc_cache = cache.Cache("documents", collection + "_" + str(doc_id), "json", conf_file=self.conf_file)
+        if doc_cache.isInCache(time_limit=False):
+            spilled = doc_cache.loadFromCache()
+
+            # Entries spilled without their creation time cannot be checked, they are ignored
+            if isinstance(spilled, dict) and "created" in spilled and time.time() - spilled['created'] <= self.ttl:
+                entry = spilled['entry']
+                self.entries.put(key, entry, created=spilled['created'])
+
+        return entry
@@ -0,0 +1,189 @@
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+from sibtmvar.microservices import mongo as mg
+
+# Types of documents stored for each collection
+DOCUMENT_TYPES = ['bib', 'ana', 'metadata']
+
+# Snapshot connections, one per thread and per file
+_snapshot_connections = threading.local()
+
+
+def connect(conf_file, collection):
+    ''' Return the document store of a collection, according to the configuration (mongodb or snapshot) '''
+
+    # Use the local snapshot if configured
+    if conf_file.settings['settings_system'].get('document_store', 'mongodb') == "snapshot":
+        return SnapshotStore(collection, conf_file)
+
+    # Otherwise use mongodb
+    return MongoStore(collection, conf_file)
+
+
+def applyProjection(document, projection):
+    ''' Keep only the fields of a projection in a document (dotted fields are applied to sub-documents and lists of sub-documents) '''
+
+    # No projection, return everything
+    if document is None or not projection:
+        return document
+
+    # Group the projected fields by top level field
+    sub_projections = {}
+    for field in projection:
+        top_field, _, sub_field = field.partition(".")
+        sub_projections.setdefault(top_field, [])
+        if sub_field != "":
+            sub_projections[top_field].append(sub_field)
+
+    # Keep the identifier and the projected fields
+    projected = {}
+    if '_id' in document:
+        projected['_id'] = document['_id']
+    for top_field, sub_fields in sub_projections.items():
+        if top_field in document:
+            value = document[top_field]
+            if len(sub_fields) > 0:
+                sub_projection = {sub_field: 1 for sub_field in sub_fields}
+                if isinstance(value, list):
+                    value = [applyProjection(element, sub_projection) if isinstance(element, dict) else element for element in value]
+                elif isinstance(value, dict):
+                    value = applyProjection(value, sub_projection)
+                    value.pop('_id', None)
+            projected[top_field] = value
+
+    return projected
+
+
+class MongoStore:
+    '''
+    The MongoStore object retrieves the bib, ana and metadata documents of a collection from MongoDB
+
+    Parameters
+    ----------
+    collection: str
+        the collection of the documents (medline, pmc, ct)
+    conf_file: Configuration
+        indicate a Configuration object to use
+
+    Attributes
+    ----------
+    collection: str
+        the collection of the documents
+    errors: list
+        a list of errors encountered by the store
+
+    '''
+
+    def __init__(self, collection, conf_file):
+        ''' Connect to the mongodb database of the collection (pooled client) '''
+
+        self.collection = collection
+        self.conf_file = conf_file
+
+        # Connect to Mongodb (pooled client)
+        self.mongo = mg.connect(conf_file.settings['url']['mongodb'], conf_file.settings['settings_system']['client_mongodb_' + collection])
+        self.errors = self.mongo.errors
+
+    def isAvailable(self):
+        ''' Return true if the database is reachable '''
+        return self.mongo.database is not None
+
+    def getCollectionName(self, document_type):
+        ''' Return the mongodb collection storing a type of documents '''
+        return self.conf_file.settings['settings_system']['mongodb_collection_' + document_type + '_' + self.collection]
+
+    def query(self, document_type, doc_id, projection=None):
+        ''' Return a document by identifier, or None if not found '''
+        return self.mongo.query(self.getCollectionName(document_type), {"_id": doc_id}, projection)
+
+    def queryMany(self, document_type, ids, projection=None):
+        ''' Return a set of documents by identifiers, as a dictionary indexed by identifier '''
+        chunk_size = self.conf_file.settings['settings_system'].get('mongodb_chunk_size', 1000)
+        return self.mongo.queryMany(self.getCollectionName(document_type), ids, chunk_size, projection=projection)
+
+
+class SnapshotStore:
+    '''
+    The SnapshotStore object retrieves the bib, ana and metadata documents of a collection from a local SQLite snapshot (documents stored as compressed json)
+
+    Parameters
+    ----------
+    collection: str
+        the collection of the documents (medline, pmc, ct)
+    conf_file: Configuration
+        indicate a Configuration object to use
+
+    Attributes
+    ----------
+    collection: str
+        the collection of the documents
+    file_name: str
+        the snapshot file
+    errors: list
+        a list of errors encountered by the store
+
+    '''
+
+    def __init__(self, collection, conf_file):
+        ''' Open the snapshot file (one read-only connection per thread) '''
+
+        # Initialize a variable to store errors
+        self.errors = []
+
+        self.collection = collection
+        self.file_name = conf_file.settings['settings_system']['snapshot_file']
+        self.connection = self.getConnection()
+
+    def getConnection(self):
+        ''' Return the connection of the current thread to the snapshot file '''
+
+        connections = getattr(_snapshot_connections, "connections", None)
+        if connections is None:
+            connections = _snapshot_connections.connections = {}
+
+        # Open the file once per thread
+        if self.file_name not in connections:
+            try:
+                if not os.path.exists(self.file_name):
+                    raise FileNotFoundError(self.file_name)
+                connection = sqlite3.connect("file:" + self.file_name + "?mode=ro", uri=True)
+                connection.execute("PRAGMA mmap_size = 268435456")
+                connections[self.file_name] = connection
+            except:
+                self.errors.append({"level": "fatal", "service": "snapshot", "description": "Snapshot file not found", "details": self.file_name})
+                return None
+
+        return connections[self.file_name]
+
+    def isAvailable(self):
+        ''' Return true if the snapshot file is readable '''
+        return self.connection is not None
+
+    def query(self, document_type, doc_id, projection=None):
+        ''' Return a document by identifier, or None if not found '''
+
+        return self.queryMany(document_type, [doc_id], projection).get(doc_id)
+
+    def queryMany(self, document_type, ids, projection=None):
+        ''' Return a set of documents by identifiers, as a dictionary indexed by identifier '''
+
+        documents = {}
+
+        if self.connection is not None:
+
+            # Query the identifiers chunk by chunk (sqlite limits the number of parameters)
+            ids = list(dict.fromkeys(ids))
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i+500]
+                rows = self.connection.execute("SELECT id, data FROM documents WHERE type = ? AND collection = ? AND id IN (" + ",".join("?" * len(chunk)) + ")",
+                                               [document_type, self.collection] + [str(doc_id) for doc_id in chunk])
+
+                # Decompress and keep the projected fields
+                for doc_id, data in rows:
+                    documents[doc_id] = applyProjection(json.loads(zlib.decompress(data)), projection)
+
+        return documents
@@ -4,7 +4,56 @@ from sibtmvar.microservices import highlight as hl
 from sibtmvar.microservices import stats as st
 from sibtmvar.microservices import configuration as conf
 from sibtmvar.microservices import mapping as map
-from sibtmvar.microservices import mongo as mg
+from sibtmvar.microservices import docstore as ds
+from sibtmvar.microservices import lru
+from sibtmvar.microservices import doccache as dc
+
+# Pubyear and title of commented/commenting publications, indexed by pmid (None if not found)
+comments_cache = lru.LRUCache(10000)
+
+
+def fetchComments(comment_ids, conf_file):
+    ''' Return the pubyear and title of a set of medline publications, querying mongodb once for those not yet in the comments cache '''
+
+    errors = []
+
+    # Keep only publications not yet in the cache
+    missing_ids = [comment_id for comment_id in dict.fromkeys(comment_ids) if comment_id not in comments_cache]
+
+    # Query all missing publications at once
+    if len(missing_ids) > 0:
+
+        # Connect to the document store
+        store = ds.connect(conf_file, "medline")
+
+        # Query biomed to get the publications
+        comments_json = store.queryMany("bib", missing_ids, projection={"pubyear": 1, "title": 1})
+
+        # Store error handling
+        errors += store.errors
+
+        # Store in the cache (only if the store answered)
+        if store.isAvailable():
+            for comment_id in missing_ids:
+                comments_cache.put(comment_id, comments_json.get(comment_id))
+
+    return errors
+
+
+def prefetchComments(documents, conf_file):
+    ''' Resolve the comments of a set of documents with a single query '''
+
+    comment_ids = []
+
+    # Collect comments of all medline documents
+    for document in documents:
+        if document.collection == "medline" and ('comments_in' in document.ret_fields or 'comments_on' in document.ret_fields):
+            for comment_type in ['in', 'on']:
+                comments = document.requested_fields.get('comments_' + comment_type, [])
+                comment_ids += [comment_id for comment_id in comments if isinstance(comment_id, str)]
+
+    return fetchComments(comment_ids, conf_file)
+
 
 class DocumentParser:
     '''
@@ -53,6 +102,8 @@ class DocumentParser:
         a set of sentences containing the variant from the query
     cleaned_snippets: dict
         a set of sentences containing the variant from the query with highlight
+    mongo_docs: dict
+        the bib, ana and metadata documents retrieved by a bulk hydration, for the statistics identifier
     '''
 
     def __init__(self, doc_id, collection, conf_file=None, conf_mode="prod"):
@@ -78,6 +129,7 @@ class DocumentParser:
         self.rank = 0
         self.requested_fields = {}
         self.snippets ={}
+        self.mongo_docs = {}
 
         # Initiate entities to highlight
         self.hl_entities = []
@@ -103,6 +155,19 @@ class DocumentParser:
         ''' Define list of entities to highlight'''
         self.hl_entities = hl_entities
 
+    def setMongoDocuments(self, mongo_docs):
+        ''' Store the bib, ana and metadata documents retrieved by a bulk hydration '''
+        self.mongo_docs = mongo_docs
+
+    def getStatsId(self):
+        ''' Return the identifier used for statistics (pmcid for pmc) '''
+
+        doc_id = self.doc_id
+        if self.collection == "pmc":
+            doc_id = self.requested_fields['pmcid']
+
+        return doc_id
+
     def addScore(self, query_type, this_score, max_score):
         ''' Add a subscore for the document'''
         self.elastic_scores[query_type] = this_score / max_score
@@ -116,7 +181,11 @@ class DocumentParser:
         self.rank = rank
 
     def addSnippets(self, snippets_json):
-        ''' Add a set of sentences containing the variants '''
+        ''' Add a set of sentences containing the variants (a processed document must be processed again) '''
+
+        # The statistics and cleaned snippets depend on the snippets
+        if hasattr(self, "stats"):
+            del self.stats
 
         # For each section
         for section in snippets_json:
@@ -153,13 +222,25 @@ class DocumentParser:
         # Check that the collection is valid
         if self.collection in self.conf_file.settings['settings_system']['collections']:
 
-            # Connect to Mongodb
-            mongo = mg.Mongo(self.conf_file.settings['url']['mongodb'])
-            mongo.connectDb(self.conf_file.settings['settings_system']['client_mongodb_' + self.collection])
+            # Reuse the fields from the document cache if available
+            if self.loadCachedFields():
+                return
+
+            # Use the document from the bulk hydration if any (pmc hydration is indexed by pmcid)
+            if 'bib' in self.mongo_docs and self.collection != "pmc":
+                doc_json = self.mongo_docs['bib']
 
-            # Query biomed to get document
-            mongo_collection = self.conf_file.settings['settings_system']['mongodb_collection_bib_' + self.collection]
-            doc_json = mongo.query(mongo_collection, {"_id": self.doc_id})
+            # Otherwise, query biomed to get document
+            else:
+
+                # Connect to the document store
+                store = ds.connect(self.conf_file, self.collection)
+
+                # Query biomed to get document (requested fields only)
+                doc_json = store.query("bib", self.doc_id, self.getMongoProjection())
+
+                # Store error handling
+                self.errors += store.errors
 
             # If document is not retrieved, return a warning error
             if doc_json is None:
@@ -175,12 +256,6 @@ class DocumentParser:
                         authors_update.append(author_name)
                     doc_json['authors'] = authors_update
 
-            # Close MongoDb
-            mongo.closeClient()
-
-            # Mongodb error handling
-            self.errors += mongo.errors
-
             # If a document was retrieved
             if doc_json is not None:
 
@@ -192,6 +267,50 @@ class DocumentParser:
                     elif field in doc_json:
                         self.requested_fields[self.fields_mapping.convertFieldToUserNames(field)] = doc_json[field]
 
+                # Store the fields in the document cache
+                self.storeCachedFields()
+
+    def loadCachedFields(self):
+        ''' Load the requested fields from the document cache, return true if they were all cached '''
+
+        doc_cache = dc.getDocumentCache(self.conf_file)
+        if doc_cache is not None:
+
+            # Check that the cached document contains all requested fields
+            cached_fields = doc_cache.get(self.collection, self.doc_id, 'fields')
+            if cached_fields is not None and set(self.ret_fields) <= set(cached_fields['ret_fields']):
+
+                # Store requested json fields
+                for field in self.ret_fields:
+                    user_field = self.fields_mapping.convertFieldToUserNames(field)
+                    if user_field in cached_fields['values']:
+                        self.requested_fields[user_field] = cached_fields['values'][user_field]
+                return True
+
+        return False
+
+    def storeCachedFields(self):
+        ''' Store the raw requested fields in the document cache '''
+
+        doc_cache = dc.getDocumentCache(self.conf_file)
+        if doc_cache is not None:
+            values = {field: value for field, value in self.requested_fields.items() if field != "source"}
+            doc_cache.update(self.collection, self.doc_id, 'fields', {'ret_fields': list(self.ret_fields), 'values': values})
+
+    def getMongoProjection(self):
+        ''' Return the mongodb projection corresponding to the fields to return '''
+
+        projection = {}
+
+        # Comments are stored in a sub-document
+        for field in self.ret_fields:
+            if field == "comments_in" or field == "comments_on":
+                projection['comments.' + field] = 1
+            else:
+                projection[field] = 1
+
+        return projection
+
     def fetchEs(self, doc_json):
         ''' Retrieve document's information in ES '''
 
@@ -220,17 +339,13 @@ class DocumentParser:
 
 
         # Load statistics
-        doc_id = self.doc_id
-        if (self.collection == "pmc"):
-            doc_id = self.requested_fields['pmcid']
+        self.stats = st.DocStats(self.getStatsId(), self.collection, conf_file=self.conf_file, mongo_docs=self.mongo_docs)
 
-        self.stats = st.DocStats(doc_id, self.collection, conf_file=self.conf_file)
-
-        # Add population and ct in highlighted entities
-        if 'information_extraction' in self.stats.details:
-            ie_entities = []
+        # Add population and ct in highlighted entities (unless the user requested no details)
+        ie_entities = []
+        if self.conf_file.settings['settings_user'].get('details', 'full') != "none":
             for ie_type in ['clinical_trials', 'populations']:
-                for ie in self.stats.details['information_extraction'][ie_type]:
+                for ie in self.stats.getSection('information_extraction')[ie_type]:
                     element = {"type": ie_type,
                                "id": ie['term'],
                                "query_term": ie['term'],
@@ -288,19 +403,18 @@ class DocumentParser:
         # If there is a comment
         if 'comments_in' in self.requested_fields or 'comments_on' in self.requested_fields :
 
-            # Connect to Mongodb
-            mongo = mg.Mongo(self.conf_file.settings['url']['mongodb'])
-            mongo.connectDb(self.conf_file.settings['settings_system']['client_mongodb_' + self.collection])
-
-            # Query biomed to get document
-            mongo_collection = self.conf_file.settings['settings_system']['mongodb_collection_bib_' + self.collection]
+            # Resolve the comments not already in cache
+            comment_ids = []
+            for comment_type in ['in', 'on']:
+                comment_ids += self.requested_fields['comments_' + comment_type]
+            self.errors += fetchComments(comment_ids, self.conf_file)
 
             # Get comments
             for comment_type in ['in', 'on']:
                 updated_comments = []
                 comments = self.requested_fields['comments_' + comment_type]
                 for comment_id in comments:
-                    comment_json = mongo.query(mongo_collection, {"_id": comment_id})
+                    comment_json = comments_cache.get(comment_id)
                     if comment_json is not None:
                         this_comment = {}
                         this_comment['id'] = comment_id
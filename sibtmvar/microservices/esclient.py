@@ -0,0 +1,49 @@
+import threading
+
+from elasticsearch import Elasticsearch
+
+# Process-wide registry of pooled elasticsearch clients, indexed by cluster settings
+_clients = {}
+
+# Lock protecting the registry
+_registry_lock = threading.Lock()
+
+
+def getClient(url, port=9200, username="", password="", maxsize=10, timeout=60):
+    ''' Return the pooled elasticsearch client for a cluster, creating it on first use (connections are kept alive between requests) '''
+
+    key = (url, int(port), username, password)
+
+    with _registry_lock:
+
+        # Create the client only once per cluster
+        if key not in _clients:
+            options = {"port": int(port), "maxsize": maxsize, "timeout": timeout}
+            if username != "" or password != "":
+                options['http_auth'] = (username, password)
+            _clients[key] = Elasticsearch([url], **options)
+
+        return _clients[key]
+
+
+def getConfClient(conf_file):
+    ''' Return the pooled client of the elasticsearch cluster defined in a configuration '''
+
+    es_settings = conf_file.settings['elasticsearch']
+
+    return getClient(es_settings['url'], es_settings['port'], es_settings['username'], es_settings['password'],
+                     maxsize=es_settings.get('maxsize', 10), timeout=es_settings.get('timeout', 60))
+
+
+def getRequestTimeout(conf_file, nb_queries=1):
+    ''' Return the timeout (in seconds) of an elasticsearch request containing nb_queries queries (e.g. a _msearch batch, whose queries may run one after the other) '''
+    return conf_file.settings['elasticsearch'].get('timeout', 60) * max(1, nb_queries)
+
+
+def closeAllClients():
+    ''' Close every pooled client (e.g. when the process stops) '''
+
+    with _registry_lock:
+        for client in _clients.values():
+            client.transport.close()
+        _clients.clear()
@@ -1,7 +1,86 @@
 import json
+import re
 
 from sibtmvar.microservices import configuration as conf
 from sibtmvar.microservices import mapping as map
+from sibtmvar.microservices import lru
+
+# Query fragments of entities, built once and shared by all queries of the process
+fragments_cache = lru.LRUCache(10000)
+
+# Characters always splitting words in the indexed fields, equivalent to a space in a phrase query
+SYNONYM_SEPARATORS = re.compile(r"[\s\-()\[\]/;\"]+")
+
+# Settings of a highlight profile not defined in the configuration (highlight every field, as done before profiles existed)
+DEFAULT_HIGHLIGHT_PROFILE = {'type': 'plain', 'fields': 'all', 'fragment_size': 200, 'number_of_fragments': 50, 'top_n': 0}
+
+def serializeQuery(query):
+    ''' Return the canonical serialization of a query (sorted keys, no spaces), used as cache key '''
+    return json.dumps(query, sort_keys=True, separators=(',', ':'))
+
+
+def canonicalizeClause(clause):
+    ''' Return a copy of a query clause with the clauses of each bool query deduplicated and sorted '''
+
+    if isinstance(clause, dict):
+        canonical = {}
+        for key, value in clause.items():
+
+            # Bool clauses do not depend on their order
+            if key in ("must", "should", "filter", "must_not") and isinstance(value, list):
+                unique_clauses = {}
+                for sub_clause in value:
+                    sub_clause = canonicalizeClause(sub_clause)
+                    unique_clauses[serializeQuery(sub_clause)] = sub_clause
+                canonical[key] = [unique_clauses[serialized] for serialized in sorted(unique_clauses)]
+
+            else:
+                canonical[key] = canonicalizeClause(value)
+
+        return canonical
+
+    if isinstance(clause, list):
+        return [canonicalizeClause(element) for element in clause]
+
+    return clause
+
+
+def normalizeSynonym(synonym, strip_prefixes=False):
+    ''' Return the normalized form of a synonym: lower case, separators replaced by a space, optionally without p./c. prefixes '''
+
+    tokens = SYNONYM_SEPARATORS.sub(" ", synonym.lower()).split()
+    if strip_prefixes:
+        tokens = [re.sub(r"^[pc]\.(?=\w)", "", token) for token in tokens]
+
+    return " ".join(tokens)
+
+
+def compactSynonyms(synonyms, anchors=(), strip_prefixes=False):
+    ''' Return the normalized synonyms needed to keep the recall of their phrase queries: duplicates and synonyms containing another synonym (or an anchor) as a phrase are removed '''
+
+    # Normalize and deduplicate
+    normalized = set(normalizeSynonym(synonym, strip_prefixes) for synonym in synonyms)
+    normalized.discard("")
+
+    # Keep the anchors (e.g. the query term, always queried)
+    kept_tokens = [normalizeSynonym(anchor, strip_prefixes).split() for anchor in anchors]
+    kept_tokens = [tokens for tokens in kept_tokens if len(tokens) > 0]
+
+    # From the shortest to the longest, drop the synonyms containing a kept phrase
+    compacted = []
+    for synonym in sorted(normalized, key=lambda synonym: (len(synonym.split()), synonym)):
+        tokens = synonym.split()
+        subsumed = False
+        for kept in kept_tokens:
+            if any(tokens[i:i+len(kept)] == kept for i in range(len(tokens) - len(kept) + 1)):
+                subsumed = True
+                break
+        if not subsumed:
+            compacted.append(synonym)
+            kept_tokens.append(tokens)
+
+    return compacted
+
 
 class ESQueryBuilder:
     '''
@@ -41,8 +120,8 @@ class ESQueryBuilder:
             self.errors += self.conf_file.errors
 
 
-    def buildQuery(self, disease=None, gene=None, variant=None, highlight=True):
-        ''' Return the json query for a tuple disease-gene-variant '''
+    def buildQuery(self, disease=None, gene=None, variant=None, highlight=True, ids=None):
+        ''' Return the json query for a tuple disease-gene-variant (ids: only highlight these documents, for the second phase of a top-N highlight profile) '''
 
         full_query = {}
 
@@ -51,17 +130,17 @@ class ESQueryBuilder:
 
         # disease part if not null
         if disease is not None and len(disease) > 0:
-            disease_query = self.buildAnnotatedEntity(disease, expand=self.conf_file.settings['settings_user']['synonym_disease'])
+            disease_query = self.buildEntityFragment("disease", disease, expand=self.conf_file.settings['settings_user']['synonym_disease'])
             query_parts.append(disease_query)
 
         # gene part if not null
         if gene is not None and len(gene) > 0:
-            gene_query = self.buildAnnotatedEntity(gene, variant=variant, expand=self.conf_file.settings['settings_user']['synonym_gene'])
+            gene_query = self.buildEntityFragment("gene", gene, other=variant, expand=self.conf_file.settings['settings_user']['synonym_gene'])
             query_parts.append(gene_query)
 
         # variant part if not null
         if variant is not None and len(variant) > 0:
-            variant_query = self.buildVariantEntity(variant, gene=gene, expand=self.conf_file.settings['settings_user']['synonym_variant'])
+            variant_query = self.buildEntityFragment("variant", variant, other=gene, expand=self.conf_file.settings['settings_user']['synonym_variant'])
             query_parts.append(variant_query)
 
         # Add date part
@@ -73,6 +152,10 @@ class ESQueryBuilder:
         #full_query["size"] = self.conf_file.settings['settings_user']['es_results_nb']
         full_query["query"] = {"bool": {"must": query_parts}}
 
+        # Restrict to a set of documents (highlight phase)
+        if ids is not None:
+            full_query["query"]["bool"]["filter"] = {"ids": {"values": ids}}
+
         # Load mapping
         self.fields_mapping = map.FieldsMapping(self.collection)
 
@@ -87,39 +170,109 @@ class ESQueryBuilder:
             if not "pmcid" in fields:
                 fields.append("pmcid")
         full_query["_source"] = fields
+        if ids is not None:
+            full_query["_source"] = False
+
+        # Local snippets are extracted from the highlight fields, no ES highlight
+        if self.useLocalSnippets():
+            full_query["_source"] = list(dict.fromkeys(fields + self.getSnippetFields()))
+            highlight = False
 
-        # Add the highlight
-        if highlight:
+        # Add the highlight (only in the second phase if the profile highlights the top hits only)
+        if highlight and (ids is not None or self.getHighlightProfile()['top_n'] == 0):
             if variant is not None and len(variant) > 0:
                 full_query["highlight"] = self.buildHighlight(variant_query)
 
-        # Return the json
-       # print(json.dumps(full_query))
-        return json.dumps(full_query)
+        # Return the json (canonical serialization)
+        return serializeQuery(full_query)
+
+    def getHighlightProfile(self):
+        ''' Return the settings of the highlight profile selected by the user (section highlight_<profile> of the configuration) '''
+
+        profile = self.conf_file.settings['settings_user'].get('highlight_profile', 'default')
+        return dict(DEFAULT_HIGHLIGHT_PROFILE, **self.conf_file.settings.get('highlight_' + profile, {}))
+
+    def useLocalSnippets(self):
+        ''' Return true if the snippets of the collection are extracted locally (settings_user snippets_<collection>: es or local) '''
+        return self.conf_file.settings['settings_user'].get('snippets_' + self.collection, "es") == "local"
+
+    def getSnippetFields(self):
+        ''' Return the elasticsearch names of the highlight fields of the collection '''
+        return map.FieldsMapping(self.collection).convertListFromUserNames(self.conf_file.settings['settings_user']['hl_fields_' + self.collection])
+
+    def getHighlightFields(self):
+        ''' Return the elasticsearch fields to highlight: the highlight fields and the search fields of the collection '''
+
+        fields = self.getSnippetFields()
+        fields += self.conf_file.settings['settings_user'].get('search_fields_' + self.collection, [])
+
+        return list(dict.fromkeys(fields))
 
     def buildHighlight(self, variant_query):
         ''' Create the highlight part of the elasticsearch query to retrieve snippets of text containing evidence '''
 
+        # Load the highlight profile
+        profile = self.getHighlightProfile()
+
         # Initialize the clause
         highlight_part = {}
 
         # Add the elements
         highlight_part['order'] = 'score'
         highlight_part['fields'] = {}
-        highlight_part['fields']['*'] = {}
+
+        # Highlight every field
+        if profile['fields'] == "all":
+            highlight_part['fields']['*'] = {}
+            field_settings = highlight_part['fields']['*']
+
+        # Or only the highlight and search fields (settings shared by all fields)
+        else:
+            for field in self.getHighlightFields():
+                highlight_part['fields'][field] = {}
+            field_settings = highlight_part
 
         # Define the size of the snippet
-        highlight_part['fields']['*']['fragment_size'] = 200
-        highlight_part['fields']['*']['number_of_fragments'] = 50
-        highlight_part['fields']['*']['type'] = "plain"
-        highlight_part['fields']['*']['fragmenter'] = "span"
+        field_settings['fragment_size'] = profile['fragment_size']
+        field_settings['number_of_fragments'] = profile['number_of_fragments']
+        field_settings['type'] = profile['type']
+        if profile['type'] == "plain":
+            field_settings['fragmenter'] = "span"
 
         # Returns the snippets only the variants
-        highlight_part['fields']['*']['highlight_query'] = variant_query
+        field_settings['highlight_query'] = variant_query
 
         # Return the clause
         return highlight_part
 
+    def buildEntityFragment(self, entity_type, entity, other=None, expand=True):
+        ''' Return the canonical query part of a disease, gene or variant, built once and reused by the following queries (other: the variant of a gene, the gene of a variant) '''
+
+        # Only the query term of the other entity is used in the query part
+        if entity_type == "gene":
+            other_key = other['query_term'] if other is not None else None
+        else:
+            other_key = [element['query_term'] for element in other] if other is not None else None
+
+        # Define the key of the fragment
+        search_fields = self.conf_file.settings['settings_user'].get('search_fields_' + self.collection)
+        compaction = [self.conf_file.settings['settings_system'].get(setting, False) for setting in ('compact_synonyms', 'strip_variant_prefixes', 'collapse_synonyms')]
+        key = (self.collection, entity_type, json.dumps([entity, other_key, expand, search_fields, compaction], sort_keys=True, default=str))
+
+        # Build the fragment if not yet done
+        fragment = fragments_cache.get(key)
+        if fragment is None:
+            if entity_type == "variant":
+                fragment = self.buildVariantEntity(entity, gene=other, expand=expand)
+            elif entity_type == "gene":
+                fragment = self.buildAnnotatedEntity(entity, variant=other, expand=expand)
+            else:
+                fragment = self.buildAnnotatedEntity(entity, expand=expand)
+            fragment = canonicalizeClause(fragment)
+            fragments_cache.put(key, fragment)
+
+        return fragment
+
     def buildAnnotatedEntity(self, entities, variant=None, expand=True):
         ''' Return a part of the query for an annotated entity '''
 
@@ -178,12 +331,30 @@ class ESQueryBuilder:
             match_init_term = self.buildMultiMatch(variant['query_term'])
             entity_parts.append(match_init_term)
 
-        # entity as any synonym
+        # entity as any synonym (normalized: trimmed, one synonym per case-insensitive form)
         if expand:
+            synonyms = {}
             for synonym in variant['all_terms']:
-                if synonym.lower() != variant['query_term'].lower():
-                    match_init_term = self.buildMultiMatch(synonym)
-                    entity_parts.append(match_init_term)
+                synonym = synonym.strip()
+                if synonym != "" and synonym.lower() != variant['query_term'].lower():
+                    synonyms[synonym.lower()] = min(synonym, synonyms.get(synonym.lower(), synonym))
+            synonyms = sorted(synonyms.values())
+
+            # Compact the synonyms if required
+            if self.conf_file.settings['settings_system'].get('compact_synonyms', False):
+                anchors = [variant['query_term']] if variant['query_term'] != "none" else []
+                synonyms = compactSynonyms(synonyms, anchors, self.conf_file.settings['settings_system'].get('strip_variant_prefixes', False))
+
+                # Collapse the single word synonyms in a single clause matching any of them
+                if self.conf_file.settings['settings_system'].get('collapse_synonyms', False):
+                    single_words = [synonym for synonym in synonyms if re.fullmatch(r"[a-z0-9]+", synonym)]
+                    if len(single_words) > 1:
+                        synonyms = [synonym for synonym in synonyms if synonym not in single_words]
+                        entity_parts.append({"multi_match": {"query": " ".join(single_words), "fields": self.conf_file.settings['settings_user']['search_fields_' + self.collection], "operator": "or"}})
+
+            for synonym in synonyms:
+                match_init_term = self.buildMultiMatch(synonym)
+                entity_parts.append(match_init_term)
 
         # entity as gene_variant merged together if gene
         if variant['query_term'] != "none" and gene is not None:
@@ -0,0 +1,104 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from sibtmvar.microservices import configuration as conf
+from sibtmvar.microservices import essearch as es
+
+
+class EsScheduler:
+    '''
+    The EsScheduler object executes the ES queries of many requests (e.g. the topics and collections of a rankVar job) with _msearch batches, keeping a bounded number of batches in flight
+
+    Parameters
+    ----------
+    conf_mode: str
+        indicate which configuration file should be used (default: prod)
+    conf_file: Configuration
+        indicate a Configuration object to use (default: None)
+
+    Attributes
+    ----------
+    batch_size: int
+        the maximum number of queries per _msearch request
+    max_in_flight: int
+        the maximum number of _msearch requests running at the same time
+    conf_file: Configuration
+        indicate a Configuration object to use (default: None)
+    errors: list
+        stores a list of errors with a json format
+    highlight_failures: set
+        the (Json query, collection) pairs rejected by ES because of their highlight
+
+    '''
+
+    def __init__(self, conf_file=None, conf_mode="prod"):
+        ''' The constructor loads the batching settings '''
+
+        # Initialize a variable to store errors
+        self.errors = []
+        self.highlight_failures = set()
+
+        # Load configuration file
+        self.conf_file = conf_file
+        if conf_file is None:
+            self.conf_file = conf.Configuration(conf_mode)
+            # Cache error handling
+            self.errors += self.conf_file.errors
+
+        # Load settings
+        self.batch_size = max(1, self.conf_file.settings['settings_system'].get('msearch_batch_size', 50))
+        self.max_in_flight = max(1, self.conf_file.settings['settings_system'].get('msearch_in_flight', 4))
+
+    def execute(self, query_sets):
+        ''' Execute a list of query sets (each one a list of (Json query, collection)) and yield the outputs of each set, in order, as soon as they are available '''
+
+        # Flatten the queries and cut them in batches
+        queries = [query for query_set in query_sets for query in query_set]
+        batches = [queries[i:i+self.batch_size] for i in range(0, len(queries), self.batch_size)]
+
+        outputs = []
+        next_set = 0
+        next_query = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+
+            # Submit the first batches
+            pending = deque()
+            next_batch = 0
+            while next_batch < len(batches) and len(pending) < self.max_in_flight:
+                pending.append(executor.submit(self.executeBatch, batches[next_batch]))
+                next_batch += 1
+
+            # Yield the sets with all their outputs available, before waiting for the next batch
+            while next_set < len(query_sets):
+                while next_set < len(query_sets) and next_query + len(query_sets[next_set]) <= len(outputs):
+                    yield outputs[next_query:next_query + len(query_sets[next_set])]
+                    next_query += len(query_sets[next_set])
+                    next_set += 1
+
+                if len(pending) > 0:
+
+                    # Wait for the oldest batch and submit a new one
+                    batch_outputs, batch_errors, batch_highlight_failures = pending.popleft().result()
+                    outputs += batch_outputs
+                    self.errors += batch_errors
+                    self.highlight_failures |= batch_highlight_failures
+                    if next_batch < len(batches):
+                        pending.append(executor.submit(self.executeBatch, batches[next_batch]))
+                        next_batch += 1
+
+                    # Release the outputs already yielded
+                    del outputs[:next_query]
+                    next_query = 0
+
+                # Nothing left to wait for
+                else:
+                    break
+
+    def executeBatch(self, batch):
+        ''' Execute a batch of queries with a single _msearch request, return the outputs, the errors and the queries failing because of their highlight '''
+
+        es_search = es.EsSearch(conf_file=self.conf_file)
+        outputs = es_search.executeQueries(batch)
+
+        return outputs, es_search.errors, es_search.highlight_failures
@@ -1,10 +1,85 @@
 import json
 import sys
-
-from elasticsearch import Elasticsearch
+import zlib
+from collections.abc import Sequence
 
 from sibtmvar.microservices import configuration as conf
 from sibtmvar.microservices import cache
+from sibtmvar.microservices import singleflight as sf
+from sibtmvar.microservices import esclient as esc
+
+
+def encodeResponse(json_response):
+    ''' Encode an ES response as a compact compressed record: a header line, then one line per hit with only its id, score, source, highlight and sort values '''
+
+    hits = json_response.get('hits', {}).get('hits', [])
+
+    # One json array per hit
+    lines = [json.dumps({"nb_hits": len(hits)})]
+    for hit in hits:
+        lines.append(json.dumps([hit.get('_id'), hit.get('_score'), hit.get('_source', {}), hit.get('highlight'), hit.get('sort')], separators=(',', ':')))
+
+    return zlib.compress("\n".join(lines).encode("utf-8"))
+
+
+def decodeResponse(data):
+    ''' Decode a compact record as an ES response whose hits are decoded on first access, return None if the record is corrupted '''
+
+    try:
+        lines = zlib.decompress(data).decode("utf-8").split("\n")
+        header = json.loads(lines[0])
+        if header['nb_hits'] != len(lines) - 1:
+            return None
+    except:
+        return None
+
+    return {"hits": {"hits": CompactHits(lines[1:])}}
+
+
+class CompactHits(Sequence):
+    '''
+    The CompactHits object is a read-only list of ES hits decoded from a compact record on first access (decoded hits are kept, so they can be updated)
+
+    Parameters
+    ----------
+    lines: list
+        the encoded hits, one json array per hit
+
+    '''
+
+    def __init__(self, lines):
+        ''' The constructor stores the encoded hits '''
+
+        self.lines = lines
+        self.hits = [None] * len(lines)
+
+    def decodeHit(self, i):
+        ''' Return a hit, decoding it on first access '''
+
+        if self.hits[i] is None:
+            hit_id, score, source, highlight, sort = json.loads(self.lines[i])
+            hit = {"_id": hit_id, "_score": score, "_source": source}
+            if highlight is not None:
+                hit['highlight'] = highlight
+            if sort is not None:
+                hit['sort'] = sort
+            self.hits[i] = hit
+
+        return self.hits[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.decodeHit(i) for i in range(len(self.lines))[index]]
+        return self.decodeHit(range(len(self.lines))[index])
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
 
 class EsSearch:
     '''
@@ -23,6 +98,8 @@ class EsSearch:
         indicate a Configuration object to use (default: None)
     errors: list
         stores a list of errors with a json format
+    highlight_failures: set
+        the (Json query, collection) pairs rejected by ES because of their highlight
 
     '''
     def __init__(self, conf_file=None, conf_name="prod"):
@@ -30,6 +107,7 @@ class EsSearch:
 
         # Initialize a variable to store errors
         self.errors = []
+        self.highlight_failures = set()
 
         # Initiate configuration file
         self.conf_file = conf_file
@@ -40,44 +118,108 @@ class EsSearch:
 
     def executeQuery(self, query, collection):
         ''' Executes a Json query received as a parameter in a ES collection received as a parameter and returns the results as a Json object '''
+        return self.executeQueries([(query, collection)])[0]
 
-        # Define the cache
-        es_cache = cache.Cache("es", query, "json", conf_file=self.conf_file)
-        print(query)
+    def executeQueries(self, queries):
+        ''' Executes a list of (Json query, collection) pairs with a single multi-search request and returns the results as a list of Json objects (empty for failed queries) '''
 
-        json_response = None
+        json_responses = [None] * len(queries)
 
         # Reload ES results if in cache and cache is allowed
-        if es_cache.isInCache():
-
-            # Convert the cache to json
-            json_response = es_cache.loadFromCache()
-
-
-        # Query ES if not present in cache
-        if json_response is None:
-
-            try:
-
-                es = Elasticsearch([self.conf_file.settings['elasticsearch']['url']],
-                                       http_auth=(self.conf_file.settings['elasticsearch']['username'],
-                                                  self.conf_file.settings['elasticsearch']['password']),
-                                       port=self.conf_file.settings['elasticsearch']['port'], timeout=500)
-                json_response = es.search(index=self.conf_file.settings['settings_system']['es_index_'+collection], body=query,
-                                              size=self.conf_file.settings['settings_user']['es_results_nb'])
-
-                # Store in cache
-                es_cache.storeToCache(json.dumps(json_response))
-
-                # Store errors
-                self.errors += es_cache.errors
-
-            # In case of errors, log it
-            except:
+        es_caches = []
+        for i, (query, collection) in enumerate(queries):
+            es_cache = cache.Cache("es", query, "bin", conf_file=self.conf_file)
+            if es_cache.isInCache():
+                data = es_cache.loadFromCache()
+                if data is not None:
+                    json_responses[i] = decodeResponse(data)
+            es_caches.append(es_cache)
+
+        # Group the queries not present in cache (identical queries are sent once)
+        missing_queries = {}
+        for i, (query, collection) in enumerate(queries):
+            if json_responses[i] is None:
+                missing_queries.setdefault((query, collection), []).append(i)
+
+        # Follow the identical queries already sent by other threads, lead the other ones
+        flights = {}
+        led_queries = []
+        for key in missing_queries:
+            flights[key], leader = sf.join(("es",) + key)
+            if leader:
+                led_queries.append(key)
+
+        # Query ES for all led queries at once
+        try:
+            if len(led_queries) > 0:
+                for key, json_response in zip(led_queries, self.multiSearch(led_queries)):
+                    for i in missing_queries[key]:
+                        json_responses[i] = json_response
+
+                    # Store in cache
+                    if json_response != {}:
+                        es_cache = es_caches[missing_queries[key][0]]
+                        es_cache.storeToCache(encodeResponse(json_response))
+
+                        # Store errors
+                        self.errors += es_cache.errors
+
+                    # Share the response with the followers
+                    sf.land(("es",) + key, flights[key], json_response)
+
+        # Always wake up the followers
+        finally:
+            for key in led_queries:
+                if not flights[key].done.is_set():
+                    sf.land(("es",) + key, flights[key], None)
+
+        # Wait for the queries sent by other threads (empty if they failed)
+        for key in missing_queries:
+            if key not in led_queries:
+                flights[key].done.wait()
+                for i in missing_queries[key]:
+                    json_responses[i] = flights[key].result if flights[key].result is not None else {}
+
+        # Return the json responses
+        return json_responses
+
+    def multiSearch(self, queries):
+        ''' Send a list of (Json query, collection) pairs to ES in one _msearch request and return the responses '''
+
+        # Build the multi-search body: a header and a query per line
+        body = []
+        for query, collection in queries:
+            print(query)
+            query_json = json.loads(query)
+            query_json.setdefault('size', self.conf_file.settings['settings_user']['es_results_nb'])
+            body.append(json.dumps({"index": self.conf_file.settings['settings_system']['es_index_'+collection]}))
+            body.append(json.dumps(query_json))
+
+        try:
+
+            # Use the pooled client of the cluster
+            es = esc.getConfClient(self.conf_file)
+            responses = es.msearch(body="\n".join(body) + "\n", request_timeout=esc.getRequestTimeout(self.conf_file, len(queries)))['responses']
+
+        # In case of errors, log it
+        except:
+            self.errors.append({"level": "warning", "service": "es", "description": "Elasticsearch failed",
+                                "details": str(sys.exc_info()[0])+str(sys.exc_info()[1])})
+
+            return [{}] * len(queries)
+
+        # Check each response
+        json_responses = []
+        for key, json_response in zip(queries, responses):
+            if 'error' in json_response:
+                details = json.dumps(json_response['error'])
                 self.errors.append({"level": "warning", "service": "es", "description": "Elasticsearch failed",
-                                    "details": str(sys.exc_info()[0])+str(sys.exc_info()[1])})
+                                    "details": details})
 
+                # Keep the queries failing because of their highlight (e.g. a too long field), they can be sent again without it
+                if "highlight" in details.lower():
+                    self.highlight_failures.add(key)
                 json_response = {}
+            json_responses.append(json_response)
 
-        # Return the json response
-        return json_response
+        return json_responses
@@ -119,8 +119,9 @@ class DocumentsFilling:
         # If found in mongodb, return the number of annotations
         if hasattr(parsed_document, "stats"):
             # Return the number of annotations for this annotation type
-            if hasattr(parsed_document.stats.details['facet_details'], annotation_type):
-                return len(parsed_document.stats.details['facet_details'][annotation_type])
+            facet_details = parsed_document.stats.getSection('facet_details')
+            if hasattr(facet_details, annotation_type):
+                return len(facet_details[annotation_type])
 
         # Otherwise, return 0
         else:
@@ -138,8 +139,9 @@ class DocumentsFilling:
         # If found in mongodb, return the number of annotations
         if hasattr(parsed_document, "stats"):
 
-            if hasattr(parsed_document.stats.details['query_details'], 'query_'+demographic_type):
-                demographic_value = parsed_document.stats.details['query_details']['query_'+demographic_type]
+            query_details = parsed_document.stats.getSection('query_details')
+            if hasattr(query_details, 'query_'+demographic_type):
+                demographic_value = query_details['query_'+demographic_type]
 
                 if "same" in demographic_value:
                     return (self.conf_file.settings['settings_ranking']['match_'+demographic_type+'_bonus'])
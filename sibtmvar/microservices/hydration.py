@@ -0,0 +1,135 @@
+from sibtmvar.microservices import configuration as conf
+from sibtmvar.microservices import docstore as ds
+from sibtmvar.microservices import documentparser as dp
+from sibtmvar.microservices import stats as st
+from sibtmvar.microservices import doccache as dc
+
+
+class DocumentsHydration:
+    '''
+    The DocumentsHydration object retrieves the bib, ana and metadata documents and the comments of a set of documents with bulk queries
+
+    Parameters
+    ----------
+    documents: list
+        a list of DocumentParser objects
+    conf_mode: str
+        indicate which configuration file should be used (default: prod)
+    conf_file: Configuration
+        indicate a Configuration object to use (default: None)
+    fetch: bool
+        true if the bib documents will also be used by fetchMongo (default: False)
+
+    Attributes
+    ----------
+    documents: list
+        a list of DocumentParser objects
+    fetch: bool
+        true if the bib documents will also be used by fetchMongo
+    conf_file: Configuration
+        indicate a Configuration object to use (default: None)
+    errors: list
+        stores a list of errors with a json format
+
+    '''
+
+    def __init__(self, documents, conf_file=None, conf_mode="prod", fetch=False):
+        ''' The constructor stores the documents to hydrate '''
+
+        # Initialize a variable to store errors
+        self.errors = []
+
+        # Load configuration file
+        self.conf_file = conf_file
+        if conf_file is None:
+            self.conf_file = conf.Configuration(conf_mode)
+            # Cache error handling
+            self.errors += self.conf_file.errors
+
+        # Store parameters as instance variables
+        self.documents = documents
+        self.fetch = fetch
+
+    def compute(self):
+        ''' Query each mongodb collection once per chunk of identifiers and distribute the results to the documents '''
+
+        # Group documents per collection, skipping documents already in the document cache
+        documents_per_collection = {}
+        for document in self.documents:
+            if document.collection in self.conf_file.settings['settings_system']['collections'] and not self.isCached(document):
+                documents_per_collection.setdefault(document.collection, []).append(document)
+
+        # For each collection
+        for collection, documents in documents_per_collection.items():
+
+            # Get the identifiers used for the statistics
+            ids = [document.getStatsId() for document in documents]
+
+            # Connect to the document store
+            store = ds.connect(self.conf_file, collection)
+
+            # Define the fields to retrieve (the bib document may also be used by fetchMongo, except for pmc)
+            projections = dict(st.MONGO_PROJECTIONS)
+            if self.fetch and collection != "pmc":
+                projections['bib'] = dict(projections['bib'], **documents[0].getMongoProjection())
+
+            # Query each type of documents needed by the requested sections
+            mongo_docs = {}
+            for mongo_type in self.getDocumentTypes(collection):
+                mongo_docs[mongo_type] = store.queryMany(mongo_type, ids, projection=projections[mongo_type])
+
+            # Store error handling
+            self.errors += store.errors
+
+            # Stop if the store is not available (the documents will be fetched one by one)
+            if not store.isAvailable():
+                continue
+
+            # Count the annotations of the whole batch (the annotations themselves are not kept)
+            annotation_facets = None
+            if 'ana' in mongo_docs:
+                annotation_facets = st.countAnnotations(mongo_docs.pop('ana'), self.conf_file)
+
+            # Distribute the results (None when the document is not found)
+            for document, doc_id in zip(documents, ids):
+                document_docs = {mongo_type: mongo_docs[mongo_type].get(doc_id) for mongo_type in mongo_docs}
+                if annotation_facets is not None:
+                    document_docs['annotation_facets'] = annotation_facets.get(doc_id)
+                document.setMongoDocuments(document_docs)
+
+        # Resolve the comments of all documents at once
+        self.errors += dp.prefetchComments(self.documents, self.conf_file)
+
+    def getDocumentTypes(self, collection):
+        ''' Return the types of documents needed by the requested sections of details (and by fetchMongo) '''
+
+        document_types = []
+        sections = st.getRequiredSections(self.conf_file)
+
+        # Metadata are used for information extraction, annotations and bib for facets
+        if 'information_extraction' in sections:
+            document_types.append('metadata')
+        if 'facet_details' in sections:
+            document_types += ['ana', 'bib']
+        elif self.fetch and collection != "pmc":
+            document_types.append('bib')
+
+        return document_types
+
+    def isCached(self, document):
+        ''' Return true if everything the hydration would retrieve for a document is in the document cache '''
+
+        doc_cache = dc.getDocumentCache(self.conf_file)
+        if doc_cache is None:
+            return False
+
+        # Statistics sections
+        sections = [section for section in st.getRequiredSections(self.conf_file) if section != 'query_details']
+        if not doc_cache.has(document.collection, document.getStatsId(), sections):
+            return False
+
+        # Fields for fetchMongo
+        if self.fetch and not doc_cache.has(document.collection, document.doc_id, ['fields']):
+            return False
+
+        return True
@@ -19,13 +19,39 @@ def init():
           "i_saved_days_ranklit":"1",
           "s_is_activated_ranklit":"True",
           "i_saved_days_rankvar":"1",
-          "s_is_activated_rankvar":"True"
+          "s_is_activated_rankvar":"True",
+          "i_saved_days_rankvar_id":"30",
+          "s_is_activated_rankvar_id":"True",
+          "i_saved_days_documents":"30",
+          "s_is_activated_documents":"True",
+          "i_doc_cache_size":"10000",
+          "i_doc_cache_ttl":"86400",
+          "b_doc_cache_spill":"false",
+          "i_lease_timeout":"3600",
+          "i_lease_poll":"2",
+          "i_memory_cache_mb":"256",
+          "i_memory_cache_entries":"100000",
+          "i_memory_entry_max_mb":"16",
+          "i_janitor_interval":"3600",
+          "i_expire_days_rankvar":"30",
+          "i_disk_budget_mb_synvar":"1024",
+          "i_disk_budget_mb_es":"20480",
+          "i_disk_budget_mb_ct":"2048",
+          "i_disk_budget_mb_ranklit":"10240",
+          "i_disk_budget_mb_rankvar":"20480",
+          "i_disk_budget_mb_documents":"10240",
+          "s_compression_ranklit":"gzip",
+          "s_compression_rankvar":"gzip",
+          "s_compression_rankvar_id":"gzip",
+          "s_compression_ct":"gzip"
        },
         "elasticsearch":{
             "s_url": "localhost",
             "i_port": "9200",
             "s_username":"",
-            "s_password": ""
+            "s_password": "",
+            "i_timeout": "60",
+            "i_maxsize": "10"
         },
        "repository":{
            "r_cache":"<path>/Caches/",
@@ -49,6 +75,17 @@ def init():
            "s_mongodb_collection_ana_ct":"anact2019",
            "s_es_index_medline":"med20",
            "s_es_index_pmc":"pmc20",
+           "i_mongodb_chunk_size":"1000",
+           "s_document_store":"mongodb",
+           "s_snapshot_file":"<path>/snapshot.sqlite",
+           "i_fetch_workers":"8",
+           "i_msearch_batch_size":"50",
+           "i_msearch_in_flight":"4",
+           "s_es_tiebreaker_medline":"pmid",
+           "s_es_tiebreaker_pmc":"pmcid",
+           "b_compact_synonyms":"true",
+           "b_strip_variant_prefixes":"false",
+           "b_collapse_synonyms":"false",
            "l_collections":"medline,pmc,ct"
        },
        "settings_user":{
@@ -64,7 +101,11 @@ def init():
           "l_keywords_positive":"",
           "l_keywords_negative":"",
           "b_cache":"true",
+          "s_details":"full",
+          "s_highlight_profile":"fast",
           "i_es_results_nb ":"1000",
+          "i_es_page_size":"0",
+          "i_es_min_results":"100",
           "l_fetch_fields_medline":"abstract,authors,chemicals,comments_in,comments_on,date,publication_date,journal,keywords,meshs,publication_types,title",
           "l_fetch_fields_pmc":"abstract,title,authors,date,pmc_date,journal,publication_types,pmid,keywords",
           "l_fetch_fields_ct":"abstract,title,start_date,completion_date,gender,minimum_age,maximum_age,brief_title,official_title,brief_summary,detailed_description,condition,inclusion_criteria,keywords,details",
@@ -72,7 +113,9 @@ def init():
           "l_hl_fields_pmc":"abstract,keywords,title",
           "l_hl_fields_ct":"abstract,title",
           "l_search_fields_pmc":"title,abstract,keywords,full_text,figures_captions",
-          "l_search_fields_medline":"title,abstract,mesh_terms,keywords"
+          "l_search_fields_medline":"title,abstract,mesh_terms,keywords",
+          "s_snippets_medline":"es",
+          "s_snippets_pmc":"es"
     },
        "settings_ranking":{
           "l_strategies":"relax,annot,demog,kw",
@@ -95,6 +138,27 @@ def init():
           "f_kw_pos_weight":"0.5",
           "f_kw_neg_weight":"-0.1"
        },
+       "highlight_default":{
+          "s_type":"plain",
+          "s_fields":"all",
+          "i_fragment_size":"200",
+          "i_number_of_fragments":"50",
+          "i_top_n":"0"
+       },
+       "highlight_fast":{
+          "s_type":"unified",
+          "s_fields":"search",
+          "i_fragment_size":"200",
+          "i_number_of_fragments":"5",
+          "i_top_n":"0"
+       },
+       "highlight_fvh":{
+          "s_type":"fvh",
+          "s_fields":"search",
+          "i_fragment_size":"200",
+          "i_number_of_fragments":"5",
+          "i_top_n":"0"
+       },
        "terminology":{
           "s_disease_mongo":"NCI Thesaurus",
           "s_gene_mongo":"nextprot",
@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''
+    The LRUCache object keeps a bounded number of entries in memory and evicts the least recently used ones. It is thread-safe and can be shared by a whole process.
+
+    Parameters
+    ----------
+    max_size: int
+        the maximum number of entries (default: 1000)
+    ttl: int
+        the number of seconds an entry stays valid, None to keep entries until evicted (default: None)
+    on_evict: function
+        a function called with the key, the value and the creation time of each entry evicted because the cache is full, expired entries are dropped without notification (default: None)
+    max_bytes: int
+        the maximum total size of the entries, None for no size limit (default: None)
+    sizeof: function
+        a function returning the size of a value, used with max_bytes (default: len)
+
+    Attributes
+    ----------
+    max_size: int
+        the maximum number of entries
+    ttl: int
+        the number of seconds an entry stays valid
+    max_bytes: int
+        the maximum total size of the entries
+    entries: OrderedDict
+        the entries with their creation time and size, from the least to the most recently used
+    size: int
+        the total size of the entries
+    hits: int
+        the number of successful lookups
+    misses: int
+        the number of failed lookups (missing or expired entries)
+    evictions: int
+        the number of entries evicted because the cache was full
+
+    '''
+
+    def __init__(self, max_size=1000, ttl=None, on_evict=None, max_bytes=None, sizeof=len):
+        ''' The constructor initializes an empty cache '''
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        ''' Return the entry for a key (and mark it as recently used) or the default value '''
+
+        with self.lock:
+
+            # If the key is not in the cache
+            if key not in self.entries:
+                self.misses += 1
+                return default
+
+            # If the entry is too old, remove it
+            value, created, size = self.entries[key]
+            if self.ttl is not None and time.time() - created > self.ttl:
+                del self.entries[key]
+                self.size -= size
+                self.misses += 1
+                return default
+
+            # Mark the entry as recently used
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, keep_created=False, created=None):
+        ''' Store an entry and evict the least recently used entries if the cache is full (keep_created: keep the creation time of the replaced entry, so its ttl is not reset, created: the creation time of the entry, e.g. when reloaded from the disk, default: now) '''
+
+        evicted = []
+
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+
+        with self.lock:
+
+            # Replace the previous entry
+            if created is None:
+                created = time.time()
+            if key in self.entries:
+                _, previous_created, previous_size = self.entries.pop(key)
+                self.size -= previous_size
+                if keep_created:
+                    created = previous_created
+
+            self.entries[key] = (value, created, size)
+            self.size += size
+
+            # Evict the least recently used entries (expired entries are only dropped)
+            now = time.time()
+            while len(self.entries) > self.max_size or (self.max_bytes is not None and self.size > self.max_bytes):
+                evicted_key, (evicted_value, evicted_created, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+                if self.ttl is None or now - evicted_created <= self.ttl:
+                    evicted.append((evicted_key, evicted_value, evicted_created))
+
+        # Notify evictions (outside of the lock)
+        if self.on_evict is not None:
+            for evicted_key, evicted_value, evicted_created in evicted:
+                self.on_evict(evicted_key, evicted_value, evicted_created)
+
+    def clear(self):
+        ''' Remove all entries '''
+
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def getStatistics(self):
+        ''' Return the counters of the cache as a dictionary '''
+
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def __contains__(self, key):
+
+        # Check the entry without marking it as recently used nor counting a lookup
+        with self.lock:
+            if key not in self.entries:
+                return False
+            return self.ttl is None or time.time() - self.entries[key][1] <= self.ttl
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
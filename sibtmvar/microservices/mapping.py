@@ -1,5 +1,4 @@
-import os
-import sys
+from sibtmvar.microservices import resources
 
 class FieldsMapping:
     '''
@@ -36,26 +35,15 @@ class FieldsMapping:
         self.loadMapping(collection)
 
     def loadMapping(self, collection):
-        ''' Load field mappings for the collection'''
-
-        # file location
-        location = ""
-        for possible_location in sys.path:
-            if os.path.exists(possible_location + "/sibtmvar/files/mapping_"+collection+".txt"):
-                location = possible_location
-                break
-                # Open mapping
-        try:
-            with open(location+"/sibtmvar/files/mapping_"+collection+".txt") as f:
-                for line in f:
-                    (key, val) = line.split()
-                    # Store mapping
-                    self.mapping_from_user[key] = val
-                    self.mapping_to_user[val] = key
+        ''' Load field mappings for the collection (from the mappings loaded at import) '''
+
+        # If the collection has a mapping, use it (immutable)
+        if collection in resources.FIELDS_MAPPINGS:
+            self.mapping_from_user, self.mapping_to_user = resources.FIELDS_MAPPINGS[collection]
 
         # If file is not found
-        except:
-            self.errors.append({"level": "warning", "service":"mapping", "description": "Mapping file not found", "details":location+"sibtmvar/files/mapping_"+collection+".txt"})
+        else:
+            self.errors.append({"level": "warning", "service":"mapping", "description": "Mapping file not found", "details":"sibtmvar/files/mapping_"+collection+".txt"})
 
 
     def convertFieldFromUserNames(self, field):
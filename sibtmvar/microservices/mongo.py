@@ -1,9 +1,91 @@
+import threading
+
 import pymongo as mg
 
+# Process-wide registry of pooled mongodb clients, indexed by url
+_clients = {}
+
+# Databases and collections known to exist, checked once per client
+_database_names = {}
+_collection_names = {}
+
+# Lock protecting the registry
+_registry_lock = threading.Lock()
+
+
+def getClient(url):
+    ''' Return the pooled mongodb client for a url, creating it (and checking the server) on first use '''
+
+    with _registry_lock:
+        if url in _clients:
+            return _clients[url]
+
+    # Create and check the client outside of the lock (an unavailable server does not block the other urls)
+    client = mg.MongoClient('mongodb://' + url, serverSelectionTimeoutMS=2000)
+    try:
+        client.server_info()
+        database_names = set(client.list_database_names())
+
+    # Close the client of an unavailable server (its background threads and sockets) before reporting the error
+    except:
+        client.close()
+        raise
+
+    with _registry_lock:
+
+        # Store the client and the list of its databases, unless another thread stored one meanwhile
+        if url not in _clients:
+            _database_names[url] = database_names
+            _clients[url] = client
+            client = None
+
+        stored_client = _clients[url]
+
+    # Close the client created in vain
+    if client is not None:
+        client.close()
+
+    return stored_client
+
+
+def getCollectionNames(url, database):
+    ''' Return the names of the collections of a database, listed once per client '''
+
+    with _registry_lock:
+        if (url, database) in _collection_names:
+            return _collection_names[(url, database)]
+        client = _clients[url]
+
+    # List the collections outside of the lock
+    collection_names = set(client[database].list_collection_names())
+
+    with _registry_lock:
+        return _collection_names.setdefault((url, database), collection_names)
+
+
+def connect(url, database):
+    ''' Return a Mongo object using the pooled client and connected to a database '''
+
+    mongo = Mongo(url)
+    mongo.connectDb(database)
+
+    return mongo
+
+
+def closeAllClients():
+    ''' Close every pooled client (e.g. when the process stops) '''
+
+    with _registry_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _database_names.clear()
+        _collection_names.clear()
+
 
 class Mongo():
     '''
-    The Mongo object connects to the MongoDB database
+    The Mongo object connects to the MongoDB database, using a client shared by the whole process
 
     Parameters
     ----------
@@ -14,29 +96,32 @@ class Mongo():
     ----------
     errors: list
         a list of errors encountered by the mongodb service
+    url: String
+        the url of the mongodb server
     client: MongoClient
-        a mongodb client
+        a pooled mongodb client
     database
         a mongodb database
 
     '''
 
     def __init__(self, url="localhost:27017"):
-        ''' Create the mongodb client'''
+        ''' Get the pooled mongodb client'''
 
         # Initialize a variable to store errors
         self.errors = []
 
         # Connect to mongodb
+        self.url = url
+        self.database = None
         self.createClient(url)
 
     def createClient(self, url):
-        ''' Creates the mongodb client '''
+        ''' Retrieves the pooled mongodb client '''
 
         try:
-            # Connect to mongodb
-            self.client = mg.MongoClient('mongodb://' + url, serverSelectionTimeoutMS=2000)
-            self.client.server_info()
+            # Get the shared client (created on first use)
+            self.client = getClient(url)
 
         except:
             # If the client creation failed, log the error
@@ -52,33 +137,53 @@ class Mongo():
         if self.client is not None:
 
             # Check if the required database exist, if not, log an error
-            if not database in self.client.list_database_names():
+            if not database in _database_names[self.url]:
                 self.errors.append({"level": "warning", "service":"mongodb", "description": "Mongodb database not found", "details":database})
 
             # If it exist, connect to the database
             else:
                 self.database = self.client[database]
 
-    def query(self, collection, query):
-        ''' Execute a mongodb query in a given collection '''
+    def query(self, collection, query, projection=None):
+        ''' Execute a mongodb query in a given collection (optionally limited to a projection) '''
 
         # If the connection to the database worked:
         if self.database is not None:
 
             # Check if the collection exists
-            if collection in self.database.collection_names():
-                json = self.database[collection].find_one(query)
+            if collection in getCollectionNames(self.url, self.database.name):
+                json = self.database[collection].find_one(query, projection)
                 return json
 
             # If the collection does not exist, store the error
             else:
                 self.errors.append({"level": "warning", "service":"mongodb", "description": "Mongodb collection not found", "details":collection})
 
-    def closeClient(self):
-        ''' Stop the mongodb client '''
+    def queryMany(self, collection, ids, chunk_size=1000, projection=None):
+        ''' Retrieve a set of documents by identifiers with one $in query per chunk (optionally limited to a projection), returned as a dictionary indexed by identifier '''
 
-        # If the client worked
-        if self.client is not None:
+        documents = {}
+
+        # If the connection to the database worked:
+        if self.database is not None:
 
-            # Close it
-            self.client.close()
+            # Check if the collection exists
+            if collection in getCollectionNames(self.url, self.database.name):
+
+                # Query the identifiers chunk by chunk
+                ids = list(dict.fromkeys(ids))
+                for i in range(0, len(ids), chunk_size):
+                    for json in self.database[collection].find({"_id": {"$in": ids[i:i+chunk_size]}}, projection):
+                        documents[json['_id']] = json
+
+            # If the collection does not exist, store the error
+            else:
+                self.errors.append({"level": "warning", "service":"mongodb", "description": "Mongodb collection not found", "details":collection})
+
+        return documents
+
+    def closeClient(self):
+        ''' Release the mongodb client (the pooled client stays open for the next callers) '''
+
+        self.client = None
+        self.database = None
@@ -1,11 +1,9 @@
 import json
 import re
 import sys
-import os
-
-import pandas as pd
 
 from sibtmvar.microservices import configuration as conf
+from sibtmvar.microservices import resources
 from sibtmtermin.normalizer import normalizer
 from sibtmvar.microservices import variants
 
@@ -183,25 +181,13 @@ class Query:
     def setAge(self, age):
         self.age_txt = age
 
-        # file location
-        location = ""
-        for possible_location in sys.path:
-            if os.path.exists(possible_location + "/sibtmvar/files/mapping_age.txt"):
-                location = possible_location
-
         # Normalize age
         self.age_norm = []
         if self.age_txt is not None and self.age_txt != "none":
             for age in self.age_txt.split(";"):
 
-                # Store the cvs as a datframe
-                age_dataframe = pd.read_csv(location+"/sibtmvar/files/mapping_age.txt", sep=';')
-                age_dataframe['min age'] = age_dataframe['min age'].astype(int)
-                age_dataframe['max age'] = age_dataframe['max age'].astype(int)
-
-                # Select only rows corresponding to the age to normalize
-                selected_ages = age_dataframe[(age_dataframe['min age'] <= int(age)) &
-                                             (age_dataframe['max age'] >= int(age))].loc[:, 'term']
+                # Select only age ranges corresponding to the age to normalize (loaded at import)
+                selected_ages = [term for term, _, min_age, max_age in resources.AGE_RANGES if min_age <= int(age) <= max_age]
 
                 # Normalize selected age
                 for selected_age in selected_ages:
@@ -3,7 +3,7 @@ import urllib.request as ur
 import json
 import sys
 import math
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from sibtmvar.microservices import configuration as conf
 from sibtmvar.microservices import cache
@@ -14,7 +14,10 @@ from sibtmvar.microservices import cleaning as cl
 from sibtmvar.microservices import documentparser as dp
 from sibtmvar.microservices import scoring as sc
 from sibtmvar.microservices import filling as fi
+from sibtmvar.microservices import hydration as hy
 from sibtmvar.microservices import ct
+from sibtmvar.microservices import esclient as esc
+from sibtmvar.microservices import snippets as sn
 
 
 class RankDoc:
@@ -31,6 +34,8 @@ class RankDoc:
         indicate which configuration file should be used (default: prod)
     conf_file: Configuration
         indicate a Configuration object to use (default: None)
+    paging: bool
+        false to always retrieve all hits at once, whatever the paging settings (default: True)
 
     Attributes
     ----------
@@ -42,7 +47,7 @@ class RankDoc:
         stores a list of errors with a json format
 
     '''
-    def __init__(self, query, collection, conf_file=None, conf_mode="prod"):
+    def __init__(self, query, collection, conf_file=None, conf_mode="prod", paging=True):
         ''' The constructor stores the user request'''
 
         # Initialize a variable to store errors
@@ -58,10 +63,16 @@ class RankDoc:
         # Store user request
         self.query = query
         self.collection = collection
+        self.paging = paging
 
+        # Time spent on highlight requests (top hits highlight, re-queries without highlight)
+        self.highlight_time = timedelta(0)
 
-    def process(self, tuning=False):
-        ''' Execute the query to retrieve the ranked list of documents'''
+        # Documents already hydrated (python ids of the parsed documents)
+        self.hydrated = set()
+
+    def process(self, tuning=False, es_outputs=None, highlight_failures=None):
+        ''' Execute the query to retrieve the ranked list of documents (es_outputs: the outputs of the queries returned by prepareSearch, if executed by a scheduler, highlight_failures: the queries of the scheduler rejected because of their highlight)'''
         time_1 = datetime.now()
         # Initialize variable to store documents
         documents_per_query = []
@@ -76,46 +87,78 @@ class RankDoc:
         # For literature
         else:
 
-            # Get documents for each subquery
-            for subquery in self.query.gen_vars_norm:
-                gene, variant = subquery
-                documents = self.searchLit(self.query.disease_norm, gene, variant)
-                documents_per_query.append(documents)
+            # Get the first page of documents for each subquery (all subqueries are sent in a single request)
+            if es_outputs is None:
+                self.lit_queries = self.listLitQueries(self.query.disease_norm, self.query.gen_vars_norm)
+                self.lit_outputs = self.executeLitQueries(self.lit_queries)
+
+            # Or use the outputs of the queries already executed by a scheduler
+            else:
+                self.lit_outputs = self.executeLitQueries(self.lit_queries, es_outputs, highlight_failures=highlight_failures)
+
+            # Process the documents page by page, and search deeper while not enough documents survive the cleaning (only the documents of the new page are processed)
+            self.lit_documents = [{} for i in range(len(self.query.gen_vars_norm))]
+            self.lit_max_scores = [output['hits']['hits'][0]["_score"] if len(output.get('hits', {}).get('hits', [])) > 0 else None for output in self.lit_outputs]
+            self.lit_hits_nb = [0] * len(self.lit_queries)
+            self.lit_exhausted = set()
+            page = (list(range(len(self.lit_queries))), self.lit_outputs)
+            merged_df = None
+            kept_df = None
+            while True:
+                page_queries, page_outputs = page
+                touched = set()
+                self.parseLitResults([self.lit_queries[i] for i in page_queries], page_outputs, len(self.query.gen_vars_norm),
+                                     documents_per_query=self.lit_documents, max_scores=[self.lit_max_scores[i] for i in page_queries], touched=touched)
 
+                time_interval = datetime.now() - time_1
+                if not tuning:
+                    print("search: "+str(time_interval))
+                    print("es highlight: "+str(self.highlight_time))
 
-            time_interval = datetime.now() - time_1
-            if not tuning:
-                print("search: "+str(time_interval))
+                # Merge the documents of the page (with their scores of all pages)
+                self.merge([{doc_id: document for doc_id, document in documents.items() if doc_id in touched} for documents in self.lit_documents])
+                merged_df = self.appendPage(merged_df, self.documents_df, touched)
 
-            # Merge documents
-            self.merge(documents_per_query)
+                time_interval = datetime.now() - time_1
+                if not tuning:
+                    print("merged: "+str(time_interval))
 
-            time_interval = datetime.now() - time_1
-            if not tuning:
-                print("merged: "+str(time_interval))
+                # Hydrate documents
+                self.hydrate()
 
-            # Highlight documents
-            self.highlight()
+                time_interval = datetime.now() - time_1
+                if not tuning:
+                    print("hydrated: "+str(time_interval))
 
-            time_interval = datetime.now() - time_1
-            if not tuning:
-                print("highlight: " + str(time_interval))
+                # Highlight documents
+                self.highlight()
 
-            # Fill documents
+                time_interval = datetime.now() - time_1
+                if not tuning:
+                    print("highlight: " + str(time_interval))
+
+                # Clean documents
+                if not tuning:
+                    self.clean()
+                    kept_df = self.appendPage(kept_df, self.documents_df, touched)
+                    time_interval = datetime.now() - time_1
+                    print("clean: "+str(time_interval))
+
+                # Stop if enough documents or nothing more to retrieve
+                page = None if tuning else self.searchNextPage(page_queries, page_outputs, len(kept_df))
+                if page is None:
+                    break
+
+            # Fill documents (scores are normalized over all merged documents), and keep the ones which survived the cleaning
+            self.documents_df = merged_df
             self.fill()
+            if not tuning:
+                self.documents_df = self.documents_df[self.documents_df.index.isin(kept_df.index)]
 
             time_interval = datetime.now() - time_1
             if not tuning:
                 print("fill: "+str(time_interval))
 
-
-
-            # Clean documents
-            if not tuning:
-                self.clean()
-                time_interval = datetime.now() - time_1
-                print("clean: "+str(time_interval))
-
             # Rank documents
             if not tuning:
                 self.rank()
@@ -124,8 +167,64 @@ class RankDoc:
                 time_interval = datetime.now() - time_1
                 print("rank: "+str(time_interval))
 
+    def processLight(self, es_outputs=None, highlight_failures=None):
+        ''' Retrieve the documents and their scores from the elasticsearch scores only (no highlight, no mongodb), enough to compute getScore (es_outputs: the outputs of the queries returned by prepareSearch(light=True), if executed by a scheduler, highlight_failures: the queries of the scheduler rejected because of their highlight)'''
+
+        # For clinical trial, call the CT webservice without fetching the trials
+        if self.collection == "ct":
+            self.searchCt(light=True)
+            return
+
+        # Get the scored documents for each subquery
+        if es_outputs is None:
+            self.lit_queries = self.listLitQueries(self.query.disease_norm, self.query.gen_vars_norm)
+        outputs = self.executeLitQueries(self.lit_queries, es_outputs, light=True, highlight_failures=highlight_failures)
+        documents_per_query = self.parseLitResults(self.lit_queries, outputs, len(self.query.gen_vars_norm), light=True)
+
+        # Merge and rank documents
+        self.merge(documents_per_query)
+        self.rankLight()
+
     def searchLit(self, disease, gene, variant):
         ''' Search for document for a triplet '''
+        return self.searchLitAll(disease, [(gene, variant)])[0]
+
+    def searchLitAll(self, disease, gen_vars):
+        ''' Search for documents for each gene-variant couple, packing the queries of all triplets in a single multi-search request '''
+
+        # Build the queries of each triplet
+        lit_queries = self.listLitQueries(disease, gen_vars)
+
+        # Execute all queries at once
+        outputs = self.executeLitQueries(lit_queries)
+
+        # Split the results back per triplet
+        return self.parseLitResults(lit_queries, outputs, len(gen_vars))
+
+    def prepareSearch(self, light=False):
+        ''' Build the ES queries of the request, to be executed by a scheduler and given back to process() (or processLight() if light), return a list of (Json query, collection) '''
+
+        # Clinical trials are retrieved by another service
+        if self.collection == "ct":
+            return []
+
+        # Build the queries of each triplet
+        self.lit_queries = self.listLitQueries(self.query.disease_norm, self.query.gen_vars_norm)
+
+        return [(self.buildEsQuery(lit_query, light=light), self.collection) for lit_query in self.lit_queries]
+
+    def listLitQueries(self, disease, gen_vars):
+        ''' Return the queries of each gene-variant couple, as (triplet index, query type, disease, gene, variant) '''
+
+        lit_queries = []
+        for index, (gene, variant) in enumerate(gen_vars):
+            for query in self.buildLitQueries(disease, gene, variant):
+                lit_queries.append((index,) + query)
+
+        return lit_queries
+
+    def buildLitQueries(self, disease, gene, variant):
+        ''' Return the exact and relaxed queries of a triplet, as (query type, disease, gene, variant) '''
 
         # Add possible queries
         queries = [("exact", disease, gene, variant)]
@@ -139,28 +238,171 @@ class RankDoc:
             if not self.conf_file.settings['settings_user']['mandatory_variant']:
                 queries.append(("dg", disease, gene, None))
 
-        # Initialize documents
-        documents = {}
+        return queries
 
-        # Perform each query
-        for query in queries:
+    def buildEsQuery(self, lit_query, highlight=True, ids=None, search_after=None, light=False):
+        ''' Build the ES json query of a (triplet index, query type, disease, gene, variant) query (ids: documents to highlight in a second phase, search_after: sort values of the last hit of the previous page, light: scores only) '''
 
-            query_type, this_disease, this_gene, this_variant = query
+        _, _, this_disease, this_gene, this_variant = lit_query
 
-            # Define ES query
-            es_builder = qb.ESQueryBuilder(self.collection, conf_file=self.conf_file)
-            query_json = es_builder.buildQuery(disease=this_disease, gene=this_gene, variant=this_variant)
-            self.errors += es_builder.errors
+        # Define ES query
+        es_builder = qb.ESQueryBuilder(self.collection, conf_file=self.conf_file)
+        query_json = es_builder.buildQuery(disease=this_disease, gene=this_gene, variant=this_variant, highlight=highlight and not light, ids=ids)
+        self.errors += es_builder.errors
 
-            # Execute query
-            es_search = es.EsSearch(conf_file=self.conf_file)
-            output = es_search.executeQuery(query_json, self.collection)
+        # Retrieve the scores only (and the pmid, used as identifier for pmc)
+        if light:
+            light_query = json.loads(query_json)
+            light_query.pop('highlight', None)
+            light_query['_source'] = ["pmid"] if self.collection == "pmc" else False
+            return qb.serializeQuery(light_query)
 
-            # In case of errors, re-query, without the highlight
-            if output == {}:
-                es_builder = qb.ESQueryBuilder(self.collection, conf_file=self.conf_file)
-                query_json = es_builder.buildQuery(disease=this_disease, gene=this_gene, variant=this_variant, highlight=False)
-                output = es_search.executeQuery(query_json, self.collection)
+        # Retrieve the hits page by page if required
+        page_size = self.getPageSize()
+        if ids is None and page_size > 0:
+            paged_query = json.loads(query_json)
+            paged_query['size'] = page_size
+            paged_query['sort'] = [{"_score": "desc"}, {self.conf_file.settings['settings_system'].get('es_tiebreaker_' + self.collection, "pmid"): "asc"}]
+            if search_after is not None:
+                paged_query['search_after'] = search_after
+            query_json = qb.serializeQuery(paged_query)
+
+        return query_json
+
+    def getPageSize(self):
+        ''' Return the number of hits retrieved per query and per page, 0 to retrieve all hits at once '''
+
+        page_size = self.conf_file.settings['settings_user'].get('es_page_size', 0)
+
+        # No paging if disabled or if a single page contains all requested hits
+        if not self.paging or page_size <= 0 or page_size >= self.conf_file.settings['settings_user']['es_results_nb']:
+            return 0
+
+        return page_size
+
+    def executeLitQueries(self, lit_queries, outputs=None, search_after=None, light=False, highlight_failures=None):
+        ''' Execute a list of (triplet index, query type, disease, gene, variant) queries with a single multi-search request (unless already executed), return the ES outputs (search_after: a list of sort values, one per query, to retrieve the next pages, light: scores only, highlight_failures: the queries already executed and rejected because of their highlight) '''
+
+        es_search = es.EsSearch(conf_file=self.conf_file)
+        if search_after is None:
+            search_after = [None] * len(lit_queries)
+
+        # Execute the queries
+        queries = [(self.buildEsQuery(lit_query, search_after=after, light=light), self.collection) for lit_query, after in zip(lit_queries, search_after)]
+        if outputs is None:
+            outputs = es_search.executeQueries(queries)
+        outputs = list(outputs)
+
+        time_1 = datetime.now()
+
+        # In case of errors caused by the highlight, re-query, without the highlight (other failures, e.g. a timeout, are not sent again)
+        if highlight_failures is None:
+            highlight_failures = set()
+        highlight_failures = highlight_failures | es_search.highlight_failures
+        failed = [i for i, output in enumerate(outputs) if output == {} and queries[i] in highlight_failures]
+        if len(failed) > 0:
+            retry_outputs = es_search.executeQueries([(self.buildEsQuery(lit_queries[i], highlight=False, search_after=search_after[i], light=light), self.collection) for i in failed])
+            for i, output in zip(failed, retry_outputs):
+                outputs[i] = output
+
+        # Highlight the top hits (of each page) in a second phase if required by the highlight profile
+        es_builder = qb.ESQueryBuilder(self.collection, conf_file=self.conf_file)
+        top_n = es_builder.getHighlightProfile()['top_n']
+        if top_n > 0 and not es_builder.useLocalSnippets() and not light:
+            self.highlightTopHits(lit_queries, outputs, top_n, es_search)
+
+        self.highlight_time += datetime.now() - time_1
+
+        # Store search errors
+        self.errors += es_search.errors
+
+        return outputs
+
+    def highlightTopHits(self, lit_queries, outputs, top_n, es_search):
+        ''' Retrieve the highlight of the top N hits of each output with a single multi-search request, and add it to the hits '''
+
+        # Build a highlight query restricted to the top hits of each output (a variant is needed to highlight)
+        hl_queries = []
+        hl_outputs = []
+        for lit_query, output in zip(lit_queries, outputs):
+            variant = lit_query[4]
+            if 'hits' in output and len(output['hits']['hits']) > 0 and variant is not None and len(variant) > 0:
+                ids = [document_json["_id"] for document_json in output['hits']['hits'][:top_n]]
+                hl_queries.append((self.buildEsQuery(lit_query, ids=ids), self.collection))
+                hl_outputs.append(output)
+
+        # Execute the highlight queries and add the highlight to the hits
+        for output, hl_output in zip(hl_outputs, es_search.executeQueries(hl_queries)):
+            highlights = {document_json["_id"]: document_json["highlight"] for document_json in hl_output.get('hits', {}).get('hits', []) if "highlight" in document_json}
+            for document_json in output['hits']['hits']:
+                if document_json["_id"] in highlights:
+                    document_json["highlight"] = highlights[document_json["_id"]]
+
+    def searchNextPage(self, page_queries, page_outputs, nb_documents):
+        ''' Retrieve the next page of the queries not yet exhausted if not enough documents survived the cleaning (page_queries and page_outputs: the indexes and outputs of the last page), return the indexes and the outputs of the next page, None if there is nothing more to retrieve '''
+
+        page_size = self.getPageSize()
+        if page_size == 0:
+            return None
+
+        # Select the queries with a full last page and less hits than requested
+        next_queries = []
+        search_after = []
+        for i, output in zip(page_queries, page_outputs):
+            hits = output.get('hits', {}).get('hits', [])
+            self.lit_hits_nb[i] += len(hits)
+
+            # No next page after a partial page
+            if len(hits) < page_size or 'sort' not in hits[-1]:
+                self.lit_exhausted.add(i)
+
+            elif i not in self.lit_exhausted and self.lit_hits_nb[i] < self.conf_file.settings['settings_user']['es_results_nb']:
+                next_queries.append(i)
+                search_after.append(hits[-1]['sort'])
+
+        # Stop if enough documents survived the cleaning, or if all queries are exhausted
+        min_results = self.conf_file.settings['settings_user'].get('es_min_results', self.conf_file.settings['settings_user']['es_results_nb'])
+        if nb_documents >= min_results or len(next_queries) == 0:
+            return None
+
+        # Retrieve the next pages, after the last hit of each query
+        return next_queries, self.executeLitQueries([self.lit_queries[i] for i in next_queries], search_after=search_after)
+
+    def appendPage(self, documents_df, page_df, touched):
+        ''' Add the documents of a page to a dataframe of documents, replacing the documents of the page (touched: the identifiers of the documents parsed in the page) '''
+
+        if documents_df is None:
+            return page_df
+
+        return pd.concat([documents_df[~documents_df.index.isin(list(touched))], page_df])
+
+    def parseLitResults(self, lit_queries, outputs, nb_triplets, light=False, documents_per_query=None, max_scores=None, touched=None):
+        ''' Parse the ES outputs of a list of queries and return the documents of each triplet (light: scores only, no fields nor snippets, documents_per_query: the documents of the previous pages to complete, max_scores: the best score of each query, used to normalize the scores of the next pages, touched: a set to fill with the identifiers of the parsed documents) '''
+
+        # Initialize documents
+        if documents_per_query is None:
+            documents_per_query = [{} for i in range(nb_triplets)]
+
+        # Check if the snippets are extracted locally
+        es_builder = qb.ESQueryBuilder(self.collection, conf_file=self.conf_file)
+        local_snippets = es_builder.useLocalSnippets() and not light
+        if local_snippets:
+            snippet_fields = es_builder.getSnippetFields()
+            max_snippets = es_builder.getHighlightProfile()['number_of_fragments']
+
+        # Parse each query
+        if max_scores is None:
+            max_scores = [None] * len(lit_queries)
+        for lit_query, output, max_score in zip(lit_queries, outputs, max_scores):
+
+            index, query_type = lit_query[0], lit_query[1]
+            documents = documents_per_query[index]
+
+            # Compile the variant terms of the query (as for the ES highlight, snippets need a variant)
+            extractor = None
+            variant = lit_query[4]
+            if local_snippets and variant is not None and len(variant) > 0:
+                extractor = sn.SnippetExtractor(variant, gene=lit_query[3], expand=self.conf_file.settings['settings_user']['synonym_variant'], max_snippets=max_snippets)
 
             # Parse query
             if 'hits' in output:
@@ -177,28 +419,29 @@ class RankDoc:
                     # If document already present, get it back
                     if doc_id in documents:
                         document_parsed = documents[doc_id]
-                        documents[doc_id] = document_parsed
 
                     # Otherwise, parse the document
                     else:
                         document_parsed = dp.DocumentParser(doc_id, self.collection, conf_file=self.conf_file)
-                        document_parsed.fetchEs(document_json)
+                        if not light:
+                            document_parsed.fetchEs(document_json)
 
                     # Add the score and snippets
-                    document_parsed.addScore(query_type, document_json["_score"], output['hits']['hits'][0]["_score"])
+                    document_parsed.addScore(query_type, document_json["_score"], max_score if max_score is not None else output['hits']['hits'][0]["_score"])
                     if "highlight" in document_json:
                         document_parsed.addSnippets(document_json['highlight'])
+                    elif extractor is not None:
+                        document_parsed.addSnippets(extractor.extract(document_json["_source"], snippet_fields))
 
                     # Store again the document
                     documents[doc_id] = document_parsed
+                    if touched is not None:
+                        touched.add(doc_id)
 
                     # handle errors
                     self.errors += document_parsed.errors
 
-            # Store search errors
-            self.errors += es_search.errors
-
-        return documents
+        return documents_per_query
 
     def merge(self, documents_per_query):
         ''' Merge documents for each gene-variant couple and for each collection '''
@@ -212,6 +455,21 @@ class RankDoc:
         #pd.set_option("display.max_rows", None, "display.max_columns", None)
         #print(self.init_documents_df)
 
+    def hydrate(self):
+        ''' Retrieve the mongodb documents of all documents with bulk queries '''
+
+        # Skip the documents already hydrated (previous pages)
+        documents = [document for document in self.documents_df['document'].tolist() if id(document) not in self.hydrated] if len(self.documents_df) > 0 else []
+
+        # If there is at least a document, hydrate the documents
+        if len(documents) > 0:
+
+            # Compute the hydration
+            hydration_function = hy.DocumentsHydration(documents, conf_file=self.conf_file)
+            hydration_function.compute()
+            self.errors += hydration_function.errors
+            self.hydrated.update(id(document) for document in documents)
+
     def fill(self):
         # If there is at least a document, fill the documents information
         if len(self.documents_df) > 0:
@@ -263,6 +521,20 @@ class RankDoc:
             # Get the dataframe with final scores
             self.documents_df = scoring_function.documents_df
 
+    def rankLight(self):
+        ''' Rank the documents from the elasticsearch scores only (exact and relaxed queries) '''
+
+        # If there is at least a document, rank the list
+        if len(self.documents_df) > 0:
+
+            # Compute the scoring function
+            scoring_function = sc.DocumentsScoring(self.documents_df, conf_file=self.conf_file)
+            scoring_function.computeLight()
+            self.errors += scoring_function.errors
+
+            # Get the dataframe with final scores
+            self.documents_df = scoring_function.documents_df
+
     def cut(self):
 
         # If there is at least a document, rank the list
@@ -361,8 +633,8 @@ class RankDoc:
         #pd.set_option("display.max_rows", None, "display.max_columns", None)
         #print(self.init_documents_df)
 
-    def searchCt(self):
-        ''' Retrieve clinical trials using CT webservice '''
+    def searchCt(self, light=False):
+        ''' Retrieve clinical trials using CT webservice (light: scores only, the trials are not fetched from mongodb) '''
 
         # Add demographics
         age = "none"
@@ -398,7 +670,8 @@ class RankDoc:
         try:
             if gender == "all":
                 gender = "none"
-            ct_str = ct.rankCT(gen_var, disease, gender, age, "yes", elasticsearch_host, elasticsearch_port, elasticsearch_index)
+            ct_str = ct.rankCT(gen_var, disease, gender, age, "yes", elasticsearch_host, elasticsearch_port, elasticsearch_index,
+                               esc.getRequestTimeout(self.conf_file))
             ct_json = json.loads(ct_str)
         except:
             ct_json = {}
@@ -411,15 +684,28 @@ class RankDoc:
         if 'clinical_trials' in ct_json:
 
             # For each clinical trial
+            documents_parsed = []
             for document_json in ct_json['clinical_trials']:
-                # Create a document and fetch its content
+                # Create a document
                 document_parsed = dp.DocumentParser(document_json["NCTid"], self.collection, conf_file=self.conf_file)
                 document_parsed.addScore("exact", document_json["score"], ct_json['clinical_trials'][0]["score"])
-                document_parsed.fetchMongo()
 
                 if "passage_variant" in document_json:
                     document_parsed.addSnippetsCT(document_json['passage_variant'])
 
+                documents_parsed.append(document_parsed)
+
+            # Hydrate all clinical trials at once
+            if not light:
+                hydration_function = hy.DocumentsHydration(documents_parsed, conf_file=self.conf_file, fetch=True)
+                hydration_function.compute()
+                self.errors += hydration_function.errors
+
+            for document_parsed in documents_parsed:
+                # Fetch its content
+                if not light:
+                    document_parsed.fetchMongo()
+
                 # Store the document
                 documents.append([document_parsed.doc_id, document_parsed, document_parsed.elastic_scores['exact']])
 
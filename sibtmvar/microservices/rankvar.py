@@ -2,6 +2,7 @@ import pandas as pd
 
 from sibtmvar.microservices import configuration as conf
 from sibtmvar.microservices import rankdoc as rd
+from sibtmvar.microservices import esscheduler as sch
 from datetime import datetime
 
 class RankVar:
@@ -47,8 +48,8 @@ class RankVar:
         ''' add a variant to the list to rank '''
         self.topics.append([topic_nb, topic_query])
 
-    def process(self, unique_id=None):
-        ''' Execute the query to retrieve the ranked list of documents'''
+    def process(self, unique_id=None, light=False):
+        ''' Execute the query to retrieve the ranked list of documents (light: compute the scores only, from elasticsearch scores)'''
 
         # Store topics in a dataframe
         self.topics_df = pd.DataFrame(self.topics, columns=['topic_nb', 'topic_query'])
@@ -57,8 +58,14 @@ class RankVar:
         if unique_id is not None:
             status_file = open(self.conf_file.settings['repository']['status'] + unique_id + ".txt", "a+")
 
+        # Gather the ES queries of all topics and collections, executed together in _msearch batches
+        collections = self.conf_file.settings['settings_user']['collections']
+        all_rankers = [rd.RankDoc(topic_query, collection, conf_file=self.conf_file, paging=False) for collection in collections for _, topic_query in self.topics]
+        scheduler = sch.EsScheduler(conf_file=self.conf_file)
+        es_outputs = scheduler.execute([ranker.prepareSearch(light=light) for ranker in all_rankers])
+
         # Search for all topics
-        for collection in self.conf_file.settings['settings_user']['collections']:
+        for collection_index, collection in enumerate(collections):
 
             # Initialize list of score for each collection
             scores_nb = []
@@ -77,9 +84,12 @@ class RankVar:
                     status_file.write(date_time + "\tSearching variant " + str(count) + "/" + str(len(self.topics)) + " in "+collection+"\n")
                     status_file.flush()
 
-                # Compute the topic
-                ranker = rd.RankDoc(topic_query, collection, conf_file=self.conf_file)
-                ranker.process()
+                # Compute the topic with the outputs of its queries
+                ranker = all_rankers[collection_index * len(self.topics) + count - 1]
+                if light:
+                    ranker.processLight(es_outputs=next(es_outputs), highlight_failures=scheduler.highlight_failures)
+                else:
+                    ranker.process(es_outputs=next(es_outputs), highlight_failures=scheduler.highlight_failures)
 
                 # Store the ranker
                 rankers.append(ranker)
@@ -99,6 +109,9 @@ class RankVar:
             self.topics_df[collection+"_sum"] = scores_sum
             self.topics_df[collection+"_ranker"] = rankers
 
+        # Scheduler error handling
+        self.errors += scheduler.errors
+
         if unique_id is not None:
             # Close the status file when over
             status_file.close()
@@ -0,0 +1,75 @@
+from importlib import resources
+from types import MappingProxyType
+
+# Collections with a fields mapping file
+FIELDS_COLLECTIONS = ['medline', 'pmc', 'ct', 'supp']
+
+# Demographic facets with a mesh mapping file
+DEMOGRAPHIC_FACETS = ['age', 'gender']
+
+# Errors encountered while loading the resources
+errors = []
+
+
+def readMappingFile(name):
+    ''' Return the lines of a packaged mapping file, or None if not found '''
+
+    try:
+        return resources.files("sibtmvar").joinpath("files", "mapping_" + name + ".txt").read_text(encoding="utf-8").splitlines()
+
+    # If file is not found
+    except (FileNotFoundError, OSError):
+        errors.append({"level": "warning", "service": "file", "description": "Mapping file not found", "details": "sibtmvar/files/mapping_" + name + ".txt"})
+        return None
+
+
+def loadFieldsMappings():
+    ''' Load the fields mapping of each collection as a pair of immutable dictionaries (from user names, to user names) '''
+
+    fields_mappings = {}
+
+    for collection in FIELDS_COLLECTIONS:
+        lines = readMappingFile(collection)
+        if lines is None:
+            continue
+
+        mapping_from_user = {}
+        mapping_to_user = {}
+        for line in lines:
+            if line.strip() == "":
+                continue
+            (key, val) = line.split()
+            # Store mapping
+            mapping_from_user[key] = val
+            mapping_to_user[val] = key
+
+        fields_mappings[collection] = (MappingProxyType(mapping_from_user), MappingProxyType(mapping_to_user))
+
+    return MappingProxyType(fields_mappings)
+
+
+def loadDemographics():
+    ''' Load the mesh ids of each demographic facet as frozensets and the age ranges as tuples (term, mesh id, min age, max age) '''
+
+    valid_ids = {}
+    age_ranges = ()
+
+    for facet in DEMOGRAPHIC_FACETS:
+        lines = readMappingFile(facet)
+        if lines is None:
+            continue
+
+        # Skip the header
+        rows = [line.split(";") for line in lines[1:] if line.strip() != ""]
+        valid_ids[facet] = frozenset(row[1].strip() for row in rows)
+
+        # Store age ranges
+        if facet == "age":
+            age_ranges = tuple((row[0], row[1].strip(), int(row[2]), int(row[3])) for row in rows)
+
+    return MappingProxyType(valid_ids), age_ranges
+
+
+# Load every mapping once, at import
+FIELDS_MAPPINGS = loadFieldsMappings()
+VALID_IDS, AGE_RANGES = loadDemographics()
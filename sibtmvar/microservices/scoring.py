@@ -119,6 +119,30 @@ class DocumentsScoring:
         #print(self.documents_dataframe)
 
 
+    def computeLight(self):
+        ''' Fill the scores for each document from the elasticsearch scores only (exact and relaxed queries), without the strategies needing the documents content '''
+
+        # Compute relaxed score
+        if 'relax' in self.conf_file.settings['settings_ranking']['strategies']:
+            columns = ['dg', 'dv', 'gv']
+
+            # Normalize parents columns
+            for column in columns:
+                self.documents_df[column] = self.normalize(self.documents_df[column])
+
+            # Compute and normalize total score
+            self.documents_df['relax'] = self.documents_df.apply(lambda row: self.computeTotal(row, columns, "relax"), axis=1)
+            self.documents_df['relax'] = self.normalize(self.documents_df['relax'])
+
+        # Compute score of all subscores
+        self.documents_df['all_score'] = self.documents_df.apply(lambda row: self.computeAllScores(row, self.documents_df.columns), axis=1)
+
+        # Normalize final score
+        self.documents_df["final_score"] = self.normalize(self.documents_df["all_score"])
+
+        # Rank results
+        self.documents_df = self.documents_df.sort_values(by=['final_score'], ascending=False)
+
     def normalize(self, serie):
         ''' Normalize a pandas serie to have the best score set at 1.0 '''
 
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+
+
+class Flight:
+    '''
+    The Flight object stores the state of a computation shared by concurrent identical calls
+
+    Attributes
+    ----------
+    done: Event
+        set when the leader of the computation has finished
+    result: object
+        the result of the leader, None if the computation failed
+
+    '''
+
+    def __init__(self):
+        ''' The constructor initializes an unfinished flight '''
+
+        self.done = threading.Event()
+        self.result = None
+
+
+# Computations running in this process, indexed by key
+_flights = {}
+
+# Lock protecting the running computations
+_flights_lock = threading.Lock()
+
+
+def join(key):
+    ''' Return the flight of a key and true if the caller is its leader (and must call land), false if another thread is already computing it '''
+
+    with _flights_lock:
+
+        # Follow the running computation
+        if key in _flights:
+            return _flights[key], False
+
+        # Lead a new computation
+        flight = Flight()
+        _flights[key] = flight
+        return flight, True
+
+
+def land(key, flight, result):
+    ''' Publish the result of a leader (None if it failed) and wake up its followers '''
+
+    flight.result = result
+
+    with _flights_lock:
+        if _flights.get(key) is flight:
+            del _flights[key]
+
+    flight.done.set()
+
+
+def acquireLease(lease_file, lease_timeout):
+    ''' Create the lease file of a computation, return false if another process holds a valid lease (expired leases of crashed processes are taken over) '''
+
+    for _ in range(3):
+        try:
+            fd = os.open(lease_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            with os.fdopen(fd, "w") as f:
+                f.write(str(os.getpid()) + "\t" + str(time.time()) + "\n")
+            return True
+
+        # The directory of the lease does not exist yet (e.g. a cache shard without any file), create it and try again
+        except FileNotFoundError:
+            try:
+                os.makedirs(os.path.dirname(lease_file), exist_ok=True)
+            except OSError:
+                return True
+
+        # Another process holds the lease
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lease_file) < lease_timeout:
+                    return False
+                os.remove(lease_file)
+            except OSError:
+                pass
+
+        # The lease cannot be written (e.g. missing repository), compute without inter-process coordination
+        except OSError:
+            return True
+
+    return False
+
+
+def releaseLease(lease_file):
+    ''' Remove the lease file of a computation '''
+
+    try:
+        os.remove(lease_file)
+    except OSError:
+        pass
+
+
+def waitLease(lease_file, lease_timeout, poll_interval):
+    ''' Wait until the lease file of a computation is released or expired '''
+
+    while True:
+        try:
+            if time.time() - os.path.getmtime(lease_file) >= lease_timeout:
+                return
+        except OSError:
+            return
+        time.sleep(poll_interval)
+
+
+def keepLease(lease_file, lease_timeout, done):
+    ''' Refresh the modification time of a lease file until the computation is done '''
+
+    while not done.wait(max(1, lease_timeout / 3)):
+        try:
+            os.utime(lease_file)
+        except OSError:
+            pass
+
+
+def lead(compute, load, lease_file, lease_timeout, poll_interval):
+    ''' Compute a result once across processes: wait for the leader of another process and reload its result, or compute it under a lease '''
+
+    if lease_file is not None and load is not None:
+        while not acquireLease(lease_file, lease_timeout):
+
+            # Reload the result of the other process, or try to lead if it failed
+            waitLease(lease_file, lease_timeout, poll_interval)
+            result = load()
+            if result is not None:
+                return result
+
+    # Keep the lease alive while computing (long computations are not taken over)
+    heartbeat = None
+    if lease_file is not None and load is not None:
+        heartbeat = threading.Event()
+        threading.Thread(target=keepLease, args=(lease_file, lease_timeout, heartbeat), daemon=True).start()
+
+    try:
+        return compute()
+    finally:
+        if heartbeat is not None:
+            heartbeat.set()
+            releaseLease(lease_file)
+
+
+def run(key, compute, load=None, lease_file=None, lease_timeout=3600, poll_interval=1):
+    ''' Run compute() once for concurrent calls with the same key: the first call (leader) computes the result and the other ones (followers) wait and share it.
+    With a lease file and a load function, leaders of other processes are followed too: load() must return the result stored by the other process (e.g. reload its cache file) or None.
+    Results are shared, not copied, and None results are considered as failures (followers then try again) '''
+
+    flight, leader = join(key)
+
+    # Follow the leader of this process, or try again if it failed
+    if not leader:
+        flight.done.wait()
+        if flight.result is not None:
+            return flight.result
+        return run(key, compute, load, lease_file, lease_timeout, poll_interval)
+
+    # Lead the computation and always wake up the followers
+    result = None
+    try:
+        result = lead(compute, load, lease_file, lease_timeout, poll_interval)
+        return result
+    finally:
+        land(key, flight, result)
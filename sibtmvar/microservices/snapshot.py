@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import sqlite3
+import zlib
+
+from sibtmvar.microservices import configuration as conf
+from sibtmvar.microservices import docstore as ds
+from sibtmvar.microservices import mapping as map
+from sibtmvar.microservices import mongo as mg
+from sibtmvar.microservices import stats as st
+
+
+def getExportProjection(conf_file, collection, document_type):
+    ''' Return the fields to export for a type of documents (statistics fields, plus the fields to return for bib documents) '''
+
+    projection = dict(st.MONGO_PROJECTIONS[document_type])
+
+    # Add fields to return for bib documents
+    if document_type == "bib":
+        fields_mapping = map.FieldsMapping(collection)
+        for field in fields_mapping.convertListFromUserNames(conf_file.settings['settings_user']['fetch_fields_' + collection]) + ["pmid", "pmcid"]:
+            if field == "comments_in" or field == "comments_on":
+                projection['comments.' + field] = 1
+            else:
+                projection[field] = 1
+
+    return projection
+
+
+def export(conf_file, file_name, collections, batch_size=1000):
+    ''' Build a snapshot file with the bib, ana and metadata documents of a set of collections stored in mongodb '''
+
+    errors = []
+
+    # Create the snapshot in a temporary file
+    temp_file_name = file_name + ".tmp"
+    if os.path.exists(temp_file_name):
+        os.remove(temp_file_name)
+    connection = sqlite3.connect(temp_file_name)
+    connection.execute("CREATE TABLE documents (type TEXT, collection TEXT, id TEXT, data BLOB, PRIMARY KEY (type, collection, id)) WITHOUT ROWID")
+
+    # For each collection and type of documents
+    for collection in collections:
+        mongo = mg.connect(conf_file.settings['url']['mongodb'], conf_file.settings['settings_system']['client_mongodb_' + collection])
+
+        for document_type in ds.DOCUMENT_TYPES:
+            mongo_collection = conf_file.settings['settings_system']['mongodb_collection_' + document_type + '_' + collection]
+
+            # Skip collections not available in mongodb
+            if mongo.database is None or mongo_collection not in mg.getCollectionNames(mongo.url, mongo.database.name):
+                continue
+
+            # Copy the documents, batch by batch
+            rows = []
+            nb_documents = 0
+            for document in mongo.database[mongo_collection].find({}, getExportProjection(conf_file, collection, document_type)):
+                data = zlib.compress(json.dumps(document, default=str).encode("utf-8"))
+                rows.append((document_type, collection, str(document['_id']), data))
+                if len(rows) == batch_size:
+                    connection.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)", rows)
+                    nb_documents += len(rows)
+                    rows = []
+            connection.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)", rows)
+            nb_documents += len(rows)
+            connection.commit()
+
+            print(collection + "/" + document_type + ": " + str(nb_documents) + " documents")
+
+        # Mongodb error handling
+        errors += mongo.errors
+
+    # Replace the previous snapshot
+    connection.close()
+    os.replace(temp_file_name, file_name)
+
+    return errors
+
+
+if __name__ == "__main__":
+
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description="Build a local snapshot of the mongodb documents used by sibtm-variomes")
+    parser.add_argument("file", help="the snapshot file to create")
+    parser.add_argument("--conf", default="prod", help="the configuration to use (default: prod)")
+    parser.add_argument("--collections", default="medline,pmc,ct", help="the collections to export (default: medline,pmc,ct)")
+    args = parser.parse_args()
+
+    # Export the documents
+    conf_file = conf.Configuration(args.conf)
+    for error in conf_file.errors + export(conf_file, args.file, args.collections.split(",")):
+        print(error)
@@ -0,0 +1,78 @@
+import re
+
+from sibtmvar.microservices import ct
+
+
+class SnippetExtractor:
+    '''
+    The SnippetExtractor object selects the sentences of a document mentioning a variant, as an alternative to the elasticsearch highlight
+
+    Parameters
+    ----------
+    variant: dict
+        the normalized variant (query term and synonyms)
+    gene: list
+        the normalized genes of the query, used to match gene and variant merged together (default: None)
+    expand: bool
+        true if the variant synonyms should be matched (default: True)
+    max_snippets: int
+        the maximum number of sentences per field (default: 50)
+
+    Attributes
+    ----------
+    pattern: Pattern
+        a compiled regular expression matching any term of the variant, None if there is no term
+    max_snippets: int
+        the maximum number of sentences per field
+
+    '''
+
+    def __init__(self, variant, gene=None, expand=True, max_snippets=50):
+        ''' The constructor compiles the terms of the variant in a single regular expression '''
+
+        self.max_snippets = max_snippets
+
+        # Collect the terms matched by the elasticsearch query of the variant
+        terms = []
+        if variant['query_term'] != "none":
+            terms.append(variant['query_term'])
+            if gene is not None and len(gene) == 1 and gene[0]['query_term'] != "none":
+                terms.append(gene[0]['query_term'] + variant['query_term'])
+        if expand:
+            terms += variant['all_terms']
+
+        # Compile the terms, longest first, as whole words
+        terms = list(dict.fromkeys(term.lower() for term in terms if term.strip() != ""))
+        terms.sort(key=len, reverse=True)
+        self.pattern = None
+        if len(terms) > 0:
+            self.pattern = re.compile(r"(?<!\w)(?:" + "|".join(re.escape(term) for term in terms) + r")(?!\w)", re.IGNORECASE)
+
+    def extract(self, source, fields):
+        ''' Return the sentences of each field of a document (ES _source) mentioning the variant, with the same format as the ES highlight '''
+
+        snippets = {}
+
+        # Nothing to match
+        if self.pattern is None:
+            return snippets
+
+        for field in fields:
+
+            # Get the text of the field
+            text = source.get(field)
+            if isinstance(text, list):
+                text = " ".join(str(element) for element in text)
+            if not isinstance(text, str) or text == "":
+                continue
+
+            # Skip the sentence splitting if the variant is not mentioned at all
+            if self.pattern.search(text) is None:
+                continue
+
+            # Keep the sentences mentioning the variant
+            sentences = [sentence for sentence in ct.splitParagraphIntoSentences2(text) if self.pattern.search(sentence) is not None]
+            if len(sentences) > 0:
+                snippets[field] = sentences[:self.max_snippets]
+
+        return snippets
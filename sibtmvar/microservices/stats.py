@@ -1,12 +1,75 @@
 import json
 import re
-import sys
-import os
 
-import pandas as pd
+from collections import Counter
 
 from sibtmvar.microservices import configuration as conf
-from sibtmvar.microservices import mongo as mg
+from sibtmvar.microservices import docstore as ds
+from sibtmvar.microservices import doccache as dc
+from sibtmvar.microservices import resources
+
+# Fields of each mongodb collection needed by the statistics
+MONGO_PROJECTIONS = {
+    'metadata': {'metadatas.concept_source': 1, 'metadatas.concept_form': 1},
+    'ana': {'annotations.concept_source': 1, 'annotations.type': 1, 'annotations.concept_id': 1, 'annotations.preferred_term': 1},
+    'bib': {'mesh_terms': 1}
+}
+
+# Sections of details returned for each details level
+DETAILS_SECTIONS = {
+    'none': [],
+    'facets': ['information_extraction', 'facet_details'],
+    'full': ['information_extraction', 'facet_details', 'query_details']
+}
+
+
+def getRequiredSections(conf_file):
+    ''' Return the sections of details needed by the user (details setting) and by the ranking strategies '''
+
+    sections = list(DETAILS_SECTIONS[conf_file.settings['settings_user'].get('details', 'full')])
+
+    # Annotation and demographic strategies rely on facets
+    strategies = conf_file.settings['settings_ranking']['strategies']
+    if ('annot' in strategies or 'demog' in strategies) and 'facet_details' not in sections:
+        sections.append('facet_details')
+
+    return sections
+
+
+def countAnnotations(ana_docs, conf_file):
+    ''' Count the disease, drug and gene annotations of a batch of ana documents (indexed by identifier) and return the facets of each document '''
+
+    facets_per_doc = {}
+
+    # Get concept source for each annotation type (several types may share a source)
+    facets_per_source = {}
+    for facet in ['disease', 'drug', 'gene']:
+        facets_per_source.setdefault(conf_file.settings['terminology'][facet+"_mongo"].lower(), []).append(facet)
+
+    # For each document with annotations
+    for doc_id, ana_json in ana_docs.items():
+        if ana_json is None:
+            continue
+
+        # Count annotations of the same concept/terminology for the requested annotation types
+        counters = {facet: Counter() for facet in ['disease', 'drug', 'gene']}
+        for annotation in ana_json['annotations']:
+            concept_source = annotation.get('concept_source')
+            if isinstance(concept_source, str) and concept_source.lower() in facets_per_source:
+                key = (annotation.get('type'), annotation.get('concept_id'), annotation.get('preferred_term'))
+                if None not in key:
+                    for facet in facets_per_source[concept_source.lower()]:
+                        counters[facet][key] += 1
+
+        # Store in the json, the most frequent concepts first
+        facets_json = {}
+        for facet in ['disease', 'drug', 'gene']:
+            concepts = sorted(sorted(counters[facet].items()), key=lambda item: item[1], reverse=True)
+            facets_json[facet+"s"] = [{"id": concept_id, "preferred_term": preferred_term, "count": count} for (_, concept_id, preferred_term), count in concepts]
+        facets_per_doc[doc_id] = facets_json
+
+    return facets_per_doc
+
 
 class DocStats():
     '''
@@ -26,6 +89,8 @@ class DocStats():
         indicate which configuration file should be used (default: prod)
     conf_file: Configuration
         indicate a Configuration object to use (default: None)
+    mongo_docs: dict
+        the bib, ana and metadata documents already retrieved by a bulk hydration (default: None)
 
     Attributes
     ----------
@@ -34,13 +99,13 @@ class DocStats():
     collection: str
         the collection of the document
     details: dict
-        a dictionary of details (facet-based, query-based and ie-based)
+        a dictionary of details (facet-based, query-based and ie-based), each section is computed on first access
     errors: list
         a list of errors encountered by the mongodb service
 
     '''
 
-    def __init__(self, doc_id, collection,  conf_file=None, conf_mode="prod"):
+    def __init__(self, doc_id, collection,  conf_file=None, conf_mode="prod", mongo_docs=None):
         ''' The constructor stores the document information to process '''
 
         # Initialize a variable to store errors
@@ -57,39 +122,52 @@ class DocStats():
         self.doc_id = doc_id
         self.collection = collection
 
-        # Initialize details variable
-        self.details = {}
+        # Store the hydrated mongodb documents (bib, ana, metadata)
+        self.mongo_docs = {}
+        if mongo_docs is not None:
+            self.mongo_docs = mongo_docs
 
-        # Get each part of details
-        self.details['information_extraction'] = self.getMetadataDetails(conf_file)
+        # Initialize details variable (sections are computed on first access)
+        self.details = {}
+        self.query_args = None
 
 
     def finalizeStats(self, query_entities=None, doc_json=None, snippets_json=None):
-        self.details['facet_details'] = self.getFacetsDetails(self.conf_file)
+        ''' Store the query information used to compute the query details '''
         if query_entities and doc_json is not None and snippets_json is not None:
-            self.details['query_details'] = self.getQueryDetails(query_entities, doc_json, snippets_json)
+            self.query_args = (query_entities, doc_json, snippets_json)
+
+    def getSection(self, section):
+        ''' Return a section of details (information_extraction, facet_details or query_details), computing it on first access '''
+
+        # Compute the section if not yet done
+        if section not in self.details:
+            if section == 'information_extraction':
+                self.details[section] = self.getMetadataDetails(self.conf_file)
+            elif section == 'facet_details':
+                self.details[section] = self.getFacetsDetails(self.conf_file)
+            elif section == 'query_details' and self.query_args is not None:
+                self.details[section] = self.getQueryDetails(*self.query_args)
+
+        # Return None if the section cannot be computed
+        return self.details.get(section)
 
     def getMetadataDetails(self, conf_file):
         ''' Add facets relative to population and clinical trials extractions '''
 
+        # Reuse the section from the document cache if available
+        cached_json = self.loadCachedSection('information_extraction')
+        if cached_json is not None:
+            return cached_json
+        nb_errors = len(self.errors)
+
         # Initialize metadata json section
         metadata_json = {}
         metadata_json['populations'] = []
         metadata_json['clinical_trials'] = []
 
-        # Connect to Mongodb
-        mongo = mg.Mongo(conf_file.settings['url']['mongodb'])
-        mongo.connectDb(conf_file.settings['settings_system']['client_mongodb_'+self.collection])
-
-        # Query biomed to get document
-        mongo_collection = conf_file.settings['settings_system']['mongodb_collection_metadata_' + self.collection]
-        mongo_json = mongo.query(mongo_collection, {"_id": self.doc_id})
-
-        # Close MongoDb
-        mongo.closeClient()
-
-        # Mongodb error handling
-        self.errors += mongo.errors
+        # Get the metadata document
+        mongo_json = self.getMongoDocument("metadata")
 
         # If there is at least one metadata
         if mongo_json is not None:
@@ -105,65 +183,39 @@ class DocStats():
                 if metadata['concept_source'] == "NCTid":
                     metadata_json['clinical_trials'].append({'term': metadata['concept_form']})
 
+        # Store the section in the document cache
+        self.storeCachedSection('information_extraction', metadata_json, nb_errors)
+
         # Return metadata
         return metadata_json
 
     def getFacetsDetails(self, conf_file):
         ''' Add facets relative to annotations '''
 
+        # Reuse the section from the document cache if available
+        cached_json = self.loadCachedSection('facet_details')
+        if cached_json is not None:
+            return cached_json
+        nb_errors = len(self.errors)
+
         # Initialize facets json section
         facets_json = {}
 
-        # Connect to Mongodb
-        mongo = mg.Mongo(conf_file.settings['url']['mongodb'])
-        mongo.connectDb(conf_file.settings['settings_system']['client_mongodb_'+self.collection])
+        # Get annotation facets, already counted by the bulk hydration if available
+        if 'annotation_facets' in self.mongo_docs:
+            annotation_facets = self.mongo_docs['annotation_facets']
 
-        # Query ana to get annotations
-        mongo_ana_collection = conf_file.settings['settings_system']['mongodb_collection_ana_' + self.collection]
-        ana_json = mongo.query(mongo_ana_collection, {"_id": self.doc_id})
-
-        # Query bib to get mesh terms
-        mongo_bib_collection = conf_file.settings['settings_system']['mongodb_collection_bib_' + self.collection]
-        bib_json = mongo.query(mongo_bib_collection, {"_id": self.doc_id})
-
-        # Close MongoDb
-        mongo.closeClient()
+        # Otherwise count annotations
+        else:
+            ana_json = self.getMongoDocument("ana")
+            annotation_facets = countAnnotations({self.doc_id: ana_json}, self.conf_file).get(self.doc_id)
 
-        # Mongodb error handling
-        self.errors += mongo.errors
+        # Get mesh terms
+        bib_json = self.getMongoDocument("bib")
 
         # If there is at least one annotation
-        if ana_json is not None:
-
-            # Transform json to dataframe
-            df = pd.DataFrame(list(ana_json['annotations']),columns = ['concept_source', 'type', 'concept_id', 'preferred_term'])
-            df['concept_source'] = df['concept_source'].str.lower()
-
-            # Add a count column to the dataframe
-            count = [1 for i in df.iterrows()]
-            df['sum'] = count
-
-            # Filter to annotations of the requested annotation types
-            for facet in ['disease', 'drug',  'gene']:
-
-                # Initialize the json
-                facets_json[facet+"s"] = []
-
-                # Get concept source for the annotation type
-                concept_source = conf_file.settings['terminology'][facet+"_mongo"].lower()
-
-                # Get sub_df
-                sub_df = df[df['concept_source'] == concept_source]
-
-                # Group annotations of the same concept/terminology
-                sub_df = sub_df.groupby(['concept_source', 'type', 'concept_id', 'preferred_term'])['sum'].agg('sum')
-                sub_df = sub_df.sort_values(ascending=False)
-
-                # For each row of this concept_source
-                for index, count in sub_df.items():
-
-                    # Store in the json
-                    facets_json[facet+"s"].append({"id": index[2], "preferred_term": index[3],"count": count})
+        if annotation_facets is not None:
+            facets_json.update(annotation_facets)
 
         # Add age and gender facets
         if bib_json is not None:
@@ -189,9 +241,45 @@ class DocStats():
                             # Store in the json
                             facets_json[facet+"_groups"].append({"id": concept_id, "preferred_term": preferred_term})
 
+        # Store the section in the document cache
+        self.storeCachedSection('facet_details', facets_json, nb_errors)
+
         # Return facets
         return facets_json
 
+    def loadCachedSection(self, section):
+        ''' Return a section from the document cache, or None if not cached '''
+
+        doc_cache = dc.getDocumentCache(self.conf_file)
+        if doc_cache is not None:
+            return doc_cache.get(self.collection, self.doc_id, section)
+
+    def storeCachedSection(self, section, section_json, nb_errors):
+        ''' Store a section in the document cache, unless mongodb failed while computing it '''
+
+        doc_cache = dc.getDocumentCache(self.conf_file)
+        if doc_cache is not None:
+            if not any(error['level'] == "fatal" for error in self.errors[nb_errors:]):
+                doc_cache.update(self.collection, self.doc_id, section, section_json)
+
+    def getMongoDocument(self, mongo_type):
+        ''' Return the bib, ana or metadata document, from the bulk hydration if available, from the document store otherwise '''
+
+        # Use the document provided by the bulk hydration (None if not found in mongodb)
+        if mongo_type in self.mongo_docs:
+            return self.mongo_docs[mongo_type]
+
+        # Connect to the document store
+        store = ds.connect(self.conf_file, self.collection)
+
+        # Query the collection to get the document (needed fields only)
+        mongo_json = store.query(mongo_type, self.doc_id, MONGO_PROJECTIONS[mongo_type])
+
+        # Store error handling
+        self.errors += store.errors
+
+        return mongo_json
+
     def getQueryDetails(self, hl_entities, doc_json, snippets_json):
         ''' Add facets relative to the query '''
 
@@ -270,7 +358,7 @@ class DocStats():
         # Check presence for age/gender
         for demographic_type in demographic_types:
 
-            if demographic_type+'_groups' in self.details['facet_details']:
+            if demographic_type+'_groups' in self.getSection('facet_details'):
 
                 # Get all expected entities
                 concept_list = [hl_entity['id'] for hl_entity in hl_entities if hl_entity is not None and hl_entity['type'] == demographic_type]
@@ -278,7 +366,7 @@ class DocStats():
                 if len(concept_list) != 0:
 
                     # If there is no demographic information for this type in the mesh terms (retrieved from facets), indicate as not discussed
-                    if len(self.details['facet_details'][demographic_type+'_groups']) == 0:
+                    if len(self.getSection('facet_details')[demographic_type+'_groups']) == 0:
                         details_json['query_' + demographic_type] = demographic_type + " not discussed in this publication"
 
                     # If there is demographic information for this type in the mesh terms (retrieved from facets)
@@ -290,7 +378,7 @@ class DocStats():
                         for concept in concept_list:
 
                             # If one of the expected concept found in the demographic facets, indicate as discussed in the publication
-                            if concept in str(self.details['facet_details'][demographic_type+'_groups']):
+                            if concept in str(self.getSection('facet_details')[demographic_type+'_groups']):
                                 details_json['query_' + demographic_type] = "same " + demographic_type + " discussed in this publication"
                                 break
 
@@ -318,8 +406,8 @@ class DocStats():
             # Initialize the total count
             count_all = 0
 
-            if entity_type+"s" in self.details['facet_details']:
-                for facet in self.details['facet_details'][entity_type+"s"]:
+            if entity_type+"s" in self.getSection('facet_details'):
+                for facet in self.getSection('facet_details')[entity_type+"s"]:
                     if facet['id'] in concept_per_types:
                         count_all += facet['count']
 
@@ -342,8 +430,8 @@ class DocStats():
                     concept_status = False
 
                     # Go through each facet of this type
-                    if entity_type + "s" in self.details['facet_details']:
-                        for facet in self.details['facet_details'][entity_type + "s"]:
+                    if entity_type + "s" in self.getSection('facet_details'):
+                        for facet in self.getSection('facet_details')[entity_type + "s"]:
                             if facet['id'] == concept_id:
                                 concept_status = True
                                 break
@@ -370,32 +458,24 @@ class DocStats():
         return details_json
 
     def loadValidIds(self, facet):
-        ''' Load field mappings for the facet'''
-
-        valid_ids = []
-        # file location
-        location = ""
-        for possible_location in sys.path:
-            if os.path.exists(possible_location + "/sibtmvar/files/mapping_"+facet+".txt"):
-                location = possible_location
-                break
-
-        # Open mapping
-        try:
-            with open(location +"/sibtmvar/files/mapping_"+facet+".txt") as f:
-                next(f)
-                for line in f:
-                    elements = line.split(";")
-                    # Store mapping
-                    valid_ids.append(elements[1].strip())
+        ''' Return the mesh ids of the facet (loaded at import)'''
 
         # If file is not found
-        except:
-            self.errors.append({"level": "warning", "service":"file", "description": "Mapping file not found", "details":location +"sibtmvar/files/mapping_"+facet+".txt"})
+        if facet not in resources.VALID_IDS:
+            self.errors.append({"level": "warning", "service":"file", "description": "Mapping file not found", "details":"sibtmvar/files/mapping_"+facet+".txt"})
+            return frozenset()
 
-        return valid_ids
+        return resources.VALID_IDS[facet]
 
 
     def getJson(self):
-        ''' Return the details dictionary '''
-        return self.details
\ No newline at end of file
+        ''' Return the details dictionary, limited to the sections requested by the user '''
+
+        details_json = {}
+
+        # Compute and add each requested section
+        for section in DETAILS_SECTIONS[self.conf_file.settings['settings_user'].get('details', 'full')]:
+            if self.getSection(section) is not None:
+                details_json[section] = self.details[section]
+
+        return details_json
\ No newline at end of file